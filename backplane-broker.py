@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+## Broker relaying messages between server nodes, start the servers with WS_BACKPLANE=tcp://broker-ip:port
+import asyncio
+import os
+from dotenv import load_dotenv
+import backplane
+
+# Get env variables
+load_dotenv()
+# Local only by default, listening on other interfaces requires BACKPLANE_SECRET, shared with the servers
+ip = os.getenv("BACKPLANE_IP", "127.0.0.1")
+port = int(os.getenv("BACKPLANE_PORT", 8766))
+secret = os.getenv("BACKPLANE_SECRET")
+
+
+async def main():
+    if not secret and ip not in ("127.0.0.1", "::1", "localhost"):
+        raise SystemExit(f"Set BACKPLANE_SECRET to listen on {ip}, any client could inject messages into every node")
+    print(f"Backplane broker started at tcp://{ip}:{port}")
+    await backplane.serve_broker(ip, port, secret=secret)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Backplane broker stopped.")
@@ -0,0 +1,283 @@
+""" Pub/sub backplane relaying messages between server workers and nodes """
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import socket
+import struct
+import uuid
+from urllib.parse import urlparse
+
+# Batch frame: origin node id, message count, then for each message: sequence, length, 1 if text, payload
+BATCH_HEADER = struct.Struct(">16sI")
+MESSAGE_HEADER = struct.Struct(">QIB")
+# Frames on a broker connection are prefixed with their length
+FRAME_LENGTH = struct.Struct(">I")
+# Shared secret handshake of the TCP broker: the broker sends a random challenge, the node answers its HMAC-SHA256
+CHALLENGE_SIZE = 16
+AUTH_TIMEOUT = 5
+
+
+def encode_batch(node_id, batch):
+    parts = [BATCH_HEADER.pack(node_id, len(batch))]
+    for seq, message in batch:
+        text = isinstance(message, str)
+        payload = message.encode() if text else message
+        parts.append(MESSAGE_HEADER.pack(seq, len(payload), text))
+        parts.append(payload)
+    return b"".join(parts)
+
+
+def decode_batch(frame):
+    """ Origin node id and (seq, message) list of a batch frame, ValueError if it is malformed """
+    if len(frame) < BATCH_HEADER.size:
+        raise ValueError("Truncated batch header")
+    node_id, count = BATCH_HEADER.unpack_from(frame)
+    offset = BATCH_HEADER.size
+    if count > (len(frame) - offset) // MESSAGE_HEADER.size:
+        raise ValueError(f"Batch of {count} messages in {len(frame)} bytes")
+    messages = []
+    for _ in range(count):
+        if offset + MESSAGE_HEADER.size > len(frame):
+            raise ValueError("Truncated message header")
+        seq, length, text = MESSAGE_HEADER.unpack_from(frame, offset)
+        offset += MESSAGE_HEADER.size
+        if offset + length > len(frame):
+            raise ValueError("Truncated message payload")
+        payload = frame[offset:offset + length]
+        offset += length
+        messages.append((seq, payload.decode() if text else payload))
+    return node_id, messages
+
+
+class Backplane:
+    """
+    Base of the backplanes: publishes of the node are batched and numbered,
+    frames coming back from the backplane are filtered so on_message sees each message of the other nodes once.
+    Subclasses implement _send(frame) and call _deliver(frame) for every frame received.
+    """
+    def __init__(self, on_message, batch_delay=0, batch_size=256):
+        self.node_id = uuid.uuid4().bytes
+        self.batch_delay = batch_delay
+        self.batch_size = batch_size
+        self._on_message = on_message
+        self._seq = 0
+        self._batch = []
+        self._flush_handle = None
+        self._last_seq = {}  # origin node id -> last delivered sequence
+        self.published = 0
+        self.batches = 0
+        self.received = 0
+        self.echoes = 0
+        self.duplicates = 0
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        self.flush()
+
+    def publish(self, message):
+        """ Queue the message for the next batch, sent once the current loop iteration (or batch_delay) is over """
+        self._seq += 1
+        self._batch.append((self._seq, message))
+        self.published += 1
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            if self.batch_delay:
+                self._flush_handle = loop.call_later(self.batch_delay, self.flush)
+            else:
+                self._flush_handle = loop.call_soon(self.flush)
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        self.batches += 1
+        self._send(encode_batch(self.node_id, batch))
+
+    def _send(self, frame):
+        raise NotImplementedError
+
+    def _deliver(self, frame):
+        node_id, messages = decode_batch(frame)
+        if node_id == self.node_id:
+            # Our own publishes echoed by the backplane
+            self.echoes += len(messages)
+            return
+        last = self._last_seq.get(node_id, 0)
+        for seq, message in messages:
+            if seq <= last:
+                self.duplicates += 1
+                continue
+            last = seq
+            self.received += 1
+            self._on_message(message)
+        self._last_seq[node_id] = last
+
+    def stats(self):
+        return {
+            "published": self.published,
+            "batches": self.batches,
+            "received": self.received,
+            "echoes": self.echoes,
+            "duplicates": self.duplicates,
+        }
+
+
+# In-memory hubs by name, for nodes running in the same process
+_hubs = {}
+
+
+class InMemoryBackplane(Backplane):
+    """ Backplane between the nodes of one process sharing the hub name, frames are delivered on the next loop iteration """
+    def __init__(self, on_message, hub="default", **kwargs):
+        super().__init__(on_message, **kwargs)
+        self._hub = _hubs.setdefault(hub, set())
+        self._hub.add(self)
+
+    async def close(self):
+        await super().close()
+        self._hub.discard(self)
+
+    def _send(self, frame):
+        loop = asyncio.get_running_loop()
+        for node in self._hub:
+            loop.call_soon(node._deliver, frame)
+
+
+class BrokerBackplane(Backplane):
+    """
+    Backplane through a broker (see serve_broker) over TCP or a Unix socket.
+    The broker relays every frame to all its connections, echoes included, the connection is retried if lost.
+    A malformed frame, or one on_message fails on, is logged and dropped, the next frames are delivered.
+    With a secret the node answers the challenge of a broker started with the same secret.
+    """
+    def __init__(self, on_message, host=None, port=None, path=None, retry_delay=1, secret=None, **kwargs):
+        super().__init__(on_message, **kwargs)
+        self._host = host
+        self._port = port
+        self._path = path
+        self._retry_delay = retry_delay
+        self._secret = secret
+        self.dropped = 0
+        self._writer = None
+        self._connected = asyncio.Event()
+        self._task = None
+        self.lost = 0
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        await self._connected.wait()
+
+    async def close(self):
+        await super().close()
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+    async def _open(self):
+        if self._path is not None:
+            return await asyncio.open_unix_connection(self._path)
+        reader, writer = await asyncio.open_connection(self._host, self._port)
+        if self._secret:
+            challenge = await asyncio.wait_for(reader.readexactly(CHALLENGE_SIZE), AUTH_TIMEOUT)
+            writer.write(_answer(self._secret, challenge))
+        return reader, writer
+
+    async def _run(self):
+        while True:
+            try:
+                reader, self._writer = await self._open()
+                self._connected.set()
+                while True:
+                    length, = FRAME_LENGTH.unpack(await reader.readexactly(FRAME_LENGTH.size))
+                    frame = await reader.readexactly(length)
+                    try:
+                        self._deliver(frame)
+                    except Exception as e:
+                        self.dropped += 1
+                        logging.warning("Backplane frame of %d bytes dropped: %r", length, e)
+            except (asyncio.IncompleteReadError, ConnectionError, OSError, asyncio.TimeoutError):
+                self._writer = None
+                await asyncio.sleep(self._retry_delay)
+
+    def _send(self, frame):
+        if self._writer is None:
+            # Broker unreachable, the batch is lost for the other nodes
+            self.lost += 1
+            return
+        self._writer.write(FRAME_LENGTH.pack(len(frame)) + frame)
+
+
+def _answer(secret, challenge):
+    return hmac.new(secret.encode(), challenge, hashlib.sha256).digest()
+
+
+async def serve_broker(host=None, port=None, path=None, sock=None, secret=None):
+    """
+    Broker of BrokerBackplane: relays every frame to all the connected nodes, the publisher included.
+    With a secret a connection is relayed only once it answered the challenge with the HMAC of the secret.
+    """
+    writers = set()
+
+    async def relay(reader, writer):
+        if secret:
+            challenge = os.urandom(CHALLENGE_SIZE)
+            writer.write(challenge)
+            try:
+                answer = await asyncio.wait_for(reader.readexactly(hashlib.sha256().digest_size), AUTH_TIMEOUT)
+            except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError):
+                answer = b""
+            if not hmac.compare_digest(answer, _answer(secret, challenge)):
+                logging.warning("Backplane connection refused: %s", writer.get_extra_info("peername"))
+                writer.close()
+                return
+        writers.add(writer)
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_LENGTH.size)
+                frame = header + await reader.readexactly(FRAME_LENGTH.unpack(header)[0])
+                for node in writers:
+                    node.write(frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writers.discard(writer)
+            writer.close()
+
+    if path is not None or (sock is not None and sock.family == socket.AF_UNIX):
+        server = await asyncio.start_unix_server(relay, path=path, sock=sock)
+    else:
+        server = await asyncio.start_server(relay, host, port, sock=sock)
+    async with server:
+        await asyncio.Future()
+
+
+async def connect(url, on_message, **kwargs):
+    """
+    Start the backplane described by url, None when url is empty (single server process):
+    memory://hub, tcp://host:port or unix:///path/to/broker.sock
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        backplane = InMemoryBackplane(on_message, hub=parsed.netloc or "default", **kwargs)
+    elif parsed.scheme == "tcp":
+        # BACKPLANE_SECRET authenticates the nodes to a broker reachable over the network
+        backplane = BrokerBackplane(on_message, host=parsed.hostname, port=parsed.port,
+                                    secret=os.getenv("BACKPLANE_SECRET"), **kwargs)
+    elif parsed.scheme == "unix":
+        backplane = BrokerBackplane(on_message, path=parsed.path, **kwargs)
+    else:
+        raise ValueError(f"Unknown backplane: {url}")
+    await backplane.start()
+    return backplane
@@ -2,17 +2,20 @@
 ## Basic websocket client
 import asyncio
 import websockets
-import json
 import threading
+import os
+import wire_protocol
+from wire_protocol import SPEECH, STATUS
+
+presence = os.getenv("WS_PRESENCE", "0") == "1"  # Announce this client with a status message
 
 async def handle_messages(websocket):
     """
     Continuously listens to messages received from the server and displays them immediately.
     """
     async for message in websocket:
-        try:
-            data = json.loads(message)
-        except json.JSONDecodeError:
+        data = wire_protocol.parse(message)
+        if data is None:
             print("Received message is not a valid JSON.")
             continue
 
@@ -24,9 +27,10 @@ async def handle_messages(websocket):
 
 async def send_status(websocket, status):
     """
-    Sends a "status" type message to indicate the client's status.
+    Sends a "status" type message to announce the client's presence, only with WS_PRESENCE=1.
+    Utterances do not need it, the server never relays a message back to its sender.
     """
-    message = json.dumps({"type": "status", "status": status})
+    message = wire_protocol.frame(websocket, STATUS, status)
     await websocket.send(message)
 
 
@@ -34,22 +38,10 @@ async def send_text(websocket, text):
     """
     Sends a "speech" type message containing the entered text.
     """
-    message = json.dumps({
-        "type": "speech",
-        "text": text,
-        "from": str(websocket.remote_address)
-    })
+    message = wire_protocol.frame(websocket, SPEECH, text, **{"from": str(websocket.remote_address)})
     await websocket.send(message)
 
 
-async def send_inactive_delay(websocket):
-    """
-    Waits for a short delay and then sets the client's status to "inactive".
-    """
-    await asyncio.sleep(0.1)
-    await send_status(websocket, "inactive")
-
-
 def input_thread(websocket, loop):
     """
     Function executed in a separate thread for user input.
@@ -65,9 +57,7 @@ def input_thread(websocket, loop):
             continue  # Ignore empty inputs
 
         # Schedule message sending in the asynchronous loop via run_coroutine_threadsafe
-        asyncio.run_coroutine_threadsafe(send_status(websocket, "active"), loop)
         asyncio.run_coroutine_threadsafe(send_text(websocket, text), loop)
-        asyncio.run_coroutine_threadsafe(send_inactive_delay(websocket), loop)
 
 
 async def start_client():
@@ -76,8 +66,10 @@ async def start_client():
     and user input via a thread.
     """
     websocket_url = "ws://live-translator.madeinfck.com"  # Ensure the URL and port are correct
-    async with websockets.connect(websocket_url) as websocket:
+    async with websockets.connect(websocket_url, subprotocols=wire_protocol.client_subprotocols()) as websocket:
         print("WebSocket connection established.")
+        if presence:
+            await send_status(websocket, "online")
         # Get the current asynchronous loop
         loop = asyncio.get_running_loop()
         # Start the thread for user input
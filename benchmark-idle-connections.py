@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+## Benchmark of the connection density of basic-ws-server.py: server memory per idle connection for each profile
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import websockets
+from benchmark_utils import start_server, stop_server, process_rss
+
+PROFILES = {
+    "deflate": {"WS_COMPRESSION": "deflate"},
+    "default": {},
+    "compact": {"WS_MAX_QUEUE": "4", "WS_WRITE_LIMIT": "16384", "WS_MAX_SIZE": "65536"},
+}
+
+
+def raise_fd_limit():
+    """ Every connection is a file descriptor on both ends, the servers inherit the limit """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+async def hold(url, connections, index, ready, done, concurrency):
+    """ Open the connections, report, then keep them idle until done is set """
+    semaphore = asyncio.Semaphore(concurrency)
+    conns = []
+    failures = 0
+
+    async def open_one(i):
+        nonlocal failures
+        # Several loopback source addresses, one has not enough ephemeral ports for 100k connections
+        source = f"127.0.{index % 250}.{2 + i % 250}"
+        async with semaphore:
+            try:
+                conns.append(await websockets.connect(url, local_addr=(source, 0), ping_interval=None))
+            except (OSError, websockets.WebSocketException, asyncio.TimeoutError):
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[open_one(i) for i in range(connections)])
+    ready.put({"open": len(conns), "failures": failures, "connect_time": time.perf_counter() - started})
+    await asyncio.to_thread(done.wait)
+    for ws in conns:
+        ws.transport.abort()
+
+
+def hold_process(url, connections, index, ready, done, concurrency):
+    asyncio.run(hold(url, connections, index, ready, done, concurrency))
+
+
+def run_profile(name, env, args):
+    proc = start_server("basic-ws-server.py", args.port, tempfile.mkdtemp(prefix="bench-idle-"),
+                        LOG_MESSAGE_LEVEL="WARNING", **env)
+    try:
+        time.sleep(1)
+        baseline = process_rss(proc.pid)
+        per_proc = [args.connections // args.processes + (i < args.connections % args.processes)
+                    for i in range(args.processes)]
+        ready = multiprocessing.Queue()
+        done = multiprocessing.Event()
+        procs = [
+            multiprocessing.Process(target=hold_process, args=(
+                f"ws://127.0.0.1:{args.port}", per_proc[i], i, ready, done, args.concurrency))
+            for i in range(args.processes)
+        ]
+        for p in procs:
+            p.start()
+        stats = [ready.get() for _ in procs]
+        # Let the server settle: handshakes done, handlers parked on recv
+        time.sleep(args.settle)
+        loaded = process_rss(proc.pid)
+        done.set()
+        for p in procs:
+            p.join()
+    finally:
+        stop_server(proc)
+
+    connected = sum(s["open"] for s in stats)
+    return {
+        "profile": name,
+        "connections": connected,
+        "failures": sum(s["failures"] for s in stats),
+        "connections_per_sec": round(connected / max(s["connect_time"] for s in stats), 1),
+        "server_rss_kb_idle": baseline,
+        "server_rss_kb_loaded": loaded,
+        "bytes_per_connection": round((loaded - baseline) * 1024 / connected) if connected and loaded else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the server memory of many idle connections per profile")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help="Comma separated profiles: " + ", ".join(PROFILES))
+    parser.add_argument("--connections", type=int, default=10000, help="Idle connections, 10k to 100k")
+    parser.add_argument("--processes", type=int, default=max(1, os.cpu_count() or 1), help="Client processes")
+    parser.add_argument("--concurrency", type=int, default=500, help="Handshakes in flight per client process")
+    parser.add_argument("--settle", type=float, default=2, help="Seconds between the last connection and the measure")
+    parser.add_argument("--port", type=int, default=8797)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    limit = raise_fd_limit()
+    if args.connections + 100 > limit:
+        parser.error(f"{args.connections} connections need a file descriptor limit above {limit} (ulimit -Hn)")
+    results = [run_profile(name, PROFILES[name], args) for name in args.profiles.split(",")]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'profile':>15} {'connections':>12} {'conn/s':>9} {'rss idle kB':>12} {'rss loaded kB':>14} {'bytes/conn':>11}")
+    for r in results:
+        print(f"{r['profile']:>15} {r['connections']:>12} {r['connections_per_sec']:>9} {r['server_rss_kb_idle']:>12} "
+              f"{r['server_rss_kb_loaded']:>14} {r['bytes_per_connection']:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+## Benchmark of the verified-token cache of wss-jwt-server.py during a reconnect storm
+import argparse
+import asyncio
+import json
+import ssl
+import tempfile
+import time
+import uuid
+import jwt
+import websockets
+from benchmark_utils import self_signed_cert, start_server, stop_server
+from token_cache import TokenCache
+
+SECRET = "benchmark-secret-of-at-least-32-bytes"
+
+
+def make_tokens(count):
+    exp = int(time.time()) + 3600
+    return [jwt.encode({"user_id": str(uuid.uuid4()), "exp": exp}, SECRET, algorithm="HS256") for _ in range(count)]
+
+
+def decode_token(token):
+    try:
+        return jwt.decode(token, SECRET, algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        return None
+
+
+def bench_verify(tokens, rounds, cache_size):
+    """ Token verifications/sec when every client comes back rounds times with the same token """
+    cache = TokenCache(decode_token, max_size=cache_size)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for token in tokens:
+            cache.get(token)
+    elapsed = time.perf_counter() - started
+    return {"cache_size": cache_size, "verifications_per_sec": round(len(tokens) * rounds / elapsed), **cache.stats()}
+
+
+async def handshake(url, ssl_context, token):
+    # The token is verified by the server before the upgrade completes
+    async with websockets.connect(url, ssl=ssl_context, additional_headers={"Authorization": f"Bearer {token}"}):
+        pass
+
+
+async def storm(url, tokens, rounds, concurrency):
+    ssl_context = ssl.create_default_context()
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async def one(token):
+        nonlocal failures
+        async with semaphore:
+            try:
+                await handshake(url, ssl_context, token)
+            except (OSError, websockets.WebSocketException):
+                failures += 1
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*[one(token) for token in tokens])
+    elapsed = time.perf_counter() - started
+    return len(tokens) * rounds, failures, elapsed
+
+
+def bench_handshakes(tokens, rounds, cache_size, port, concurrency):
+    """ Connect + authenticate cycles/sec against wss-jwt-server.py """
+    cwd = tempfile.mkdtemp(prefix="bench-jwt-")
+    self_signed_cert(cwd)
+    proc = start_server("wss-jwt-server.py", port, cwd, SECRET_KEY=SECRET, JWT_CACHE_SIZE=cache_size, LOG_MESSAGE_LEVEL="WARNING")
+    try:
+        count, failures, elapsed = asyncio.run(storm(f"wss://127.0.0.1:{port}", tokens, rounds, concurrency))
+    finally:
+        stop_server(proc)
+    return {"cache_size": cache_size, "handshakes": count, "failures": failures, "handshakes_per_sec": round(count / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark token verification and handshakes with the JWT cache on and off")
+    parser.add_argument("--clients", type=int, default=200, help="Distinct tokens, one per client")
+    parser.add_argument("--rounds", type=int, default=5, help="Reconnections of every client")
+    parser.add_argument("--verify-rounds", type=int, default=200, help="Rounds of the in-process verification benchmark")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8792)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    tokens = make_tokens(args.clients)
+    results = {
+        "verify": [bench_verify(tokens, args.verify_rounds, size) for size in (0, 10000)],
+        "handshake": [bench_handshakes(tokens, args.rounds, size, args.port, args.concurrency) for size in (0, 10000)],
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results["verify"]:
+        print(f"verify    cache={r['cache_size']:>6}  {r['verifications_per_sec']:>10} verifications/s  hit ratio {r['hit_ratio']}")
+    for r in results["handshake"]:
+        print(f"handshake cache={r['cache_size']:>6}  {r['handshakes_per_sec']:>10} handshakes/s  failures {r['failures']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+## Load generator of the relay servers: connect rate, delivered messages/sec, fan-out latency and server memory
+import argparse
+import asyncio
+import json
+import multiprocessing
+import queue
+import ssl
+import statistics
+import tempfile
+import time
+import uuid
+import websockets
+import wire_protocol
+from wire_protocol import SPEECH
+from benchmark_utils import self_signed_cert, start_server, stop_server, process_rss, git_revision
+
+SERVERS = {
+    "basic": ("basic-ws-server.py", "ws"),
+    "secure": ("secure-ws-server.py", "wss"),
+    "jwt": ("wss-jwt-server.py", "wss"),
+}
+SECRET = "benchmark-secret-of-at-least-32-bytes"
+
+
+def connect_options(server, binary):
+    options = {"max_queue": None, "subprotocols": [wire_protocol.SUBPROTOCOL] if binary else None}
+    if SERVERS[server][1] == "wss":
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        options["ssl"] = context
+    return options
+
+
+def auth_headers(server):
+    if server != "jwt":
+        return None
+    import jwt
+    token = jwt.encode({"user_id": str(uuid.uuid4()), "exp": int(time.time()) + 3600}, SECRET, algorithm="HS256")
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def load(url, server, clients, senders, args, barrier):
+    """
+    Open the clients, then every sender sends speech messages at args.rate per second for args.duration seconds.
+    The send time is the first word of the text, every receiver measures the fan-out latency from it.
+    """
+    options = connect_options(server, args.binary)
+    started = time.perf_counter()
+    conns = await asyncio.gather(*[
+        websockets.connect(url, additional_headers=auth_headers(server), **options) for _ in range(clients)
+    ])
+    connect_time = time.perf_counter() - started
+    await asyncio.to_thread(barrier.wait)
+    # Let the server register every client before the first message
+    await asyncio.sleep(0.5)
+    await asyncio.to_thread(barrier.wait)
+
+    padding = "x" * max(0, args.size - 18)
+    latencies = []
+    sent = 0
+    received = 0
+    start = time.time()
+    last = start
+
+    async def send(ws):
+        nonlocal sent
+        interval = 1 / args.rate
+        deadline = time.perf_counter()
+        end = deadline + args.duration
+        while deadline < end:
+            # Same message as the clients send for an utterance
+            await ws.send(wire_protocol.frame(ws, SPEECH, f"{time.time():.6f} {padding}",
+                                              **{"from": str(ws.local_address)}))
+            sent += 1
+            deadline += interval
+            await asyncio.sleep(max(0, deadline - time.perf_counter()))
+
+    async def receive(ws):
+        nonlocal received, last
+        async for message in ws:
+            now = time.time()
+            data = wire_protocol.parse(message)
+            if data is None or data.get("type") != "speech":
+                continue
+            latencies.append(now - float(data["text"].split(" ", 1)[0]))
+            received += 1
+            last = now
+
+    receivers = [asyncio.create_task(receive(ws)) for ws in conns]
+    await asyncio.gather(*[send(ws) for ws in conns[:senders]])
+    # Drain: wait until nothing more arrives for a second
+    while True:
+        before = received
+        await asyncio.sleep(1)
+        if received == before:
+            break
+    for task in receivers:
+        task.cancel()
+    for ws in conns:
+        await ws.close()
+    return {"connect_time": connect_time, "start": start, "end": last, "sent": sent,
+            "received": received, "latencies": latencies}
+
+
+def load_process(url, server, clients, senders, args, barrier, results):
+    results.put(asyncio.run(load(url, server, clients, senders, args, barrier)))
+
+
+def percentile(quantiles, p):
+    return round(quantiles[p - 1] * 1000, 3) if quantiles else None
+
+
+def run(args):
+    script, scheme = SERVERS[args.server]
+    cwd = tempfile.mkdtemp(prefix="bench-relay-")
+    if scheme == "wss":
+        self_signed_cert(cwd)
+    proc = start_server(script, args.port, cwd, SECRET_KEY=SECRET, WS_WORKERS=args.workers,
+                        LOG_MESSAGE_LEVEL="WARNING", **dict(env.split("=", 1) for env in args.env))
+    rss_start = process_rss(proc.pid)
+    rss_peak = rss_start or 0
+    try:
+        senders = max(1, round(args.clients * args.sender_ratio))
+        per_proc = [args.clients // args.processes + (i < args.clients % args.processes) for i in range(args.processes)]
+        per_proc_senders = [senders // args.processes + (i < senders % args.processes) for i in range(args.processes)]
+        barrier = multiprocessing.Barrier(args.processes)
+        results = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=load_process, args=(
+                f"{scheme}://127.0.0.1:{args.port}", args.server, per_proc[i], per_proc_senders[i], args, barrier, results))
+            for i in range(args.processes)
+        ]
+        for p in procs:
+            p.start()
+        stats = []
+        while len(stats) < len(procs):
+            rss_peak = max(rss_peak, process_rss(proc.pid) or 0)
+            try:
+                stats.append(results.get(timeout=0.2))
+            except queue.Empty:
+                pass
+        for p in procs:
+            p.join()
+    finally:
+        stop_server(proc)
+
+    latencies = [latency for s in stats for latency in s["latencies"]]
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else []
+    elapsed = max(s["end"] for s in stats) - min(s["start"] for s in stats)
+    sent = sum(s["sent"] for s in stats)
+    received = sum(s["received"] for s in stats)
+    return {
+        "commit": git_revision(),
+        "server": args.server,
+        "workers": args.workers,
+        "binary": args.binary,
+        "clients": args.clients,
+        "senders": senders,
+        "size": args.size,
+        "rate": args.rate,
+        "connections_per_sec": round(args.clients / max(s["connect_time"] for s in stats), 1),
+        "sent": sent,
+        "delivered": received,
+        "expected": sent * (args.clients - 1),
+        "messages_per_sec": round(received / elapsed, 1) if elapsed > 0 else 0,
+        "latency_ms_p50": percentile(quantiles, 50),
+        "latency_ms_p95": percentile(quantiles, 95),
+        "latency_ms_p99": percentile(quantiles, 99),
+        "server_rss_kb_start": rss_start,
+        "server_rss_kb_peak": rss_peak or None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive simulated clients against a relay server and measure it")
+    parser.add_argument("--server", default="basic", choices=SERVERS)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--sender-ratio", type=float, default=0.05, help="Share of the clients sending messages")
+    parser.add_argument("--size", type=int, default=100, help="Text length of each message")
+    parser.add_argument("--rate", type=float, default=5, help="Messages per second of each sender")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of sending")
+    parser.add_argument("--binary", action="store_true", help="Clients negotiate the binary wire protocol")
+    parser.add_argument("--workers", type=int, default=1, help="WS_WORKERS of the server")
+    parser.add_argument("--env", action="append", default=[], help="Extra server env variable NAME=value, repeatable")
+    parser.add_argument("--processes", type=int, default=1, help="Load generator processes")
+    parser.add_argument("--port", type=int, default=8796)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    for key, value in result.items():
+        print(f"{key:>22} {value}")
+
+
+if __name__ == "__main__":
+    main()
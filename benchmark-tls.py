@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+## Benchmark of the TLS profiles of secure-ws-server.py: full and resumed handshakes per second and latency
+import argparse
+import base64
+import json
+import os
+import socket
+import ssl
+import statistics
+import tempfile
+import time
+from benchmark_utils import self_signed_cert, start_server, stop_server
+
+PROFILES = {
+    "tickets-off": {"TLS_SESSION_TICKETS": "0"},
+    "default": {},
+    "tls13": {"TLS_13_ONLY": "1"},
+    "tls13-ecdsa": {"TLS_13_ONLY": "1", "TLS_CERT_FILE": "./cert/ecdsa.crt", "TLS_KEY_FILE": "./cert/ecdsa.key"},
+}
+
+
+def handshake(port, context, session=None):
+    """ TCP connect + TLS handshake timed, then a websocket upgrade so TLS 1.3 tickets reach the client """
+    started = time.perf_counter()
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    tls = context.wrap_socket(sock, server_hostname="localhost", session=session)
+    elapsed = time.perf_counter() - started
+    key = base64.b64encode(os.urandom(16)).decode()
+    tls.sendall(
+        f"GET / HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode()
+    )
+    response = b""
+    while b"\r\n\r\n" not in response:
+        chunk = tls.recv(4096)
+        if not chunk:
+            break
+        response += chunk
+    reused = tls.session_reused
+    new_session = tls.session
+    tls.close()
+    return elapsed, reused, new_session
+
+
+def run_profile(name, env, port, count, cwd):
+    proc = start_server("secure-ws-server.py", port, cwd, LOG_MESSAGE_LEVEL="WARNING", **env)
+    try:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+        full = []
+        started = time.perf_counter()
+        for _ in range(count):
+            elapsed, _, session = handshake(port, context)
+            full.append(elapsed)
+        full_elapsed = time.perf_counter() - started
+
+        resumed = []
+        reused = 0
+        started = time.perf_counter()
+        for _ in range(count):
+            elapsed, was_reused, session = handshake(port, context, session)
+            resumed.append(elapsed)
+            reused += was_reused
+        resumed_elapsed = time.perf_counter() - started
+    finally:
+        stop_server(proc)
+
+    return {
+        "profile": name,
+        "full_handshakes_per_sec": round(count / full_elapsed, 1),
+        "full_latency_ms_p50": round(statistics.median(full) * 1000, 3),
+        "resumed_handshakes_per_sec": round(count / resumed_elapsed, 1),
+        "resumed_latency_ms_p50": round(statistics.median(resumed) * 1000, 3),
+        "resumed_ratio": round(reused / count, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark full and resumed TLS handshakes for each TLS profile")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help="Comma separated profiles: " + ", ".join(PROFILES))
+    parser.add_argument("--handshakes", type=int, default=300)
+    parser.add_argument("--port", type=int, default=8794)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    cwd = tempfile.mkdtemp(prefix="bench-tls-")
+    self_signed_cert(cwd)
+    self_signed_cert(cwd, name="ecdsa", key_type="ecdsa")
+    results = [run_profile(name, PROFILES[name], args.port, args.handshakes, cwd) for name in args.profiles.split(",")]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'profile':>12} {'full/s':>8} {'full p50 ms':>12} {'resumed/s':>10} {'resumed p50 ms':>15} {'resumed':>8}")
+    for r in results:
+        print(f"{r['profile']:>12} {r['full_handshakes_per_sec']:>8} {r['full_latency_ms_p50']:>12} "
+              f"{r['resumed_handshakes_per_sec']:>10} {r['resumed_latency_ms_p50']:>15} {r['resumed_ratio']:>8}")
+
+
+if __name__ == "__main__":
+    main()
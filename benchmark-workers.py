@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+## Benchmark of the multi-worker mode: connections/sec and delivered messages/sec for each worker count
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import websockets
+from benchmark_utils import start_server, stop_server
+
+
+async def load(url, connections, senders, messages, total_sent, barrier, size):
+    """ Open the connections, then send from the first senders connections and count what every connection receives """
+    started = time.perf_counter()
+    conns = await asyncio.gather(*[websockets.connect(url, max_queue=None) for _ in range(connections)])
+    connect_time = time.perf_counter() - started
+    await asyncio.to_thread(barrier.wait)
+    # Let every worker register its clients before the first message
+    await asyncio.sleep(0.5)
+    await asyncio.to_thread(barrier.wait)
+
+    start = time.time()
+    text = "x" * size
+    received = 0
+    last = start
+
+    async def send(ws):
+        for i in range(messages):
+            await ws.send(json.dumps({"type": "speech", "text": text, "seq": i}))
+
+    async def receive(ws, expected):
+        nonlocal received, last
+        for _ in range(expected):
+            await ws.recv()
+            received += 1
+        last = max(last, time.time())
+
+    tasks = [send(ws) for ws in conns[:senders]]
+    tasks += [receive(ws, total_sent - (messages if idx < senders else 0)) for idx, ws in enumerate(conns)]
+    try:
+        await asyncio.wait_for(asyncio.gather(*tasks), timeout=120)
+    except asyncio.TimeoutError:
+        last = time.time()
+    for ws in conns:
+        await ws.close()
+    return {"connect_time": connect_time, "connections": connections, "start": start, "end": last, "received": received}
+
+
+def load_process(url, connections, senders, messages, total_sent, barrier, size, results):
+    results.put(asyncio.run(load(url, connections, senders, messages, total_sent, barrier, size)))
+
+
+def run_once(server, workers, port, args):
+    proc = start_server(server, port, tempfile.mkdtemp(prefix="bench-"), WS_WORKERS=workers)
+    try:
+        # Spread the connections and the senders over the load processes
+        per_proc = [args.connections // args.processes + (i < args.connections % args.processes) for i in range(args.processes)]
+        senders = [args.senders // args.processes + (i < args.senders % args.processes) for i in range(args.processes)]
+        total_sent = args.senders * args.messages
+        barrier = multiprocessing.Barrier(args.processes)
+        results = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=load_process, args=(
+                f"ws://127.0.0.1:{port}", per_proc[i], senders[i], args.messages, total_sent, barrier, args.size, results))
+            for i in range(args.processes)
+        ]
+        for p in procs:
+            p.start()
+        stats = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+    finally:
+        stop_server(proc)
+
+    elapsed = max(s["end"] for s in stats) - min(s["start"] for s in stats)
+    received = sum(s["received"] for s in stats)
+    return {
+        "workers": workers,
+        "connections": args.connections,
+        "connections_per_sec": round(args.connections / max(s["connect_time"] for s in stats), 1),
+        "delivered": received,
+        "expected": args.senders * args.messages * (args.connections - 1),
+        "messages_per_sec": round(received / elapsed, 1) if elapsed > 0 else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark connections and messages per second for each worker count")
+    parser.add_argument("--server", default="basic-ws-server.py")
+    parser.add_argument("--workers", default="1,2,4", help="Comma separated worker counts")
+    parser.add_argument("--connections", type=int, default=500)
+    parser.add_argument("--senders", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=100, help="Messages sent by each sender")
+    parser.add_argument("--size", type=int, default=100, help="Text length of each message")
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="Load generator processes")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = [run_once(args.server, int(w), args.port, args) for w in args.workers.split(",")]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'workers':>8} {'conn/s':>10} {'msg/s':>12} {'delivered':>12}")
+    for r in results:
+        print(f"{r['workers']:>8} {r['connections_per_sec']:>10} {r['messages_per_sec']:>12} {r['delivered']:>6}/{r['expected']}")
+
+
+if __name__ == "__main__":
+    main()
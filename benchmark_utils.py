@@ -0,0 +1,87 @@
+""" Helpers shared by the benchmark scripts: start a server on localhost and wait for it """
+import os
+import socket
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server did not start on port {port}")
+
+
+def self_signed_cert(directory, name="localhost", key_type="rsa"):
+    """ Create ./cert/<name>.crt and .key in directory like the dev certificates of the TLS servers """
+    cert_dir = os.path.join(directory, "cert")
+    os.makedirs(cert_dir, exist_ok=True)
+    certfile = os.path.join(cert_dir, f"{name}.crt")
+    keyfile = os.path.join(cert_dir, f"{name}.key")
+    if key_type == "ecdsa":
+        key_args = ["-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1"]
+    else:
+        key_args = ["-newkey", "rsa:2048"]
+    subprocess.run(
+        ["openssl", "req", "-x509", "-nodes", "-days", "1", *key_args,
+         "-keyout", keyfile, "-out", certfile, "-subj", "/CN=localhost"],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return certfile, keyfile
+
+
+def start_server(script, port, cwd, **env):
+    """ Start one of the server scripts of the repo on 127.0.0.1:port, cwd holds its ./cert and server.log """
+    env = dict(os.environ, WS_IP="127.0.0.1", WS_PORT=str(port), **{k: str(v) for k, v in env.items()})
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, script)],
+        cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        proc.kill()
+        raise
+    return proc
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def process_rss(pid):
+    """ Resident memory in kB of the process and its children (forked workers), None where /proc is missing """
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except (OSError, StopIteration):
+            if current == pid:
+                return None
+    return total
+
+
+def git_revision():
+    """ Short commit of the repo, so benchmark results can be compared across commits """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
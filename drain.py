@@ -0,0 +1,160 @@
+""" Graceful drain of the servers on restart: staggered closes with reconnect hints and listening socket handover """
+import asyncio
+import os
+import random
+import re
+import select
+import signal
+import socket
+import subprocess
+import sys
+
+# Close code sent to the clients of a server going down for a restart
+CLOSE_SERVICE_RESTART = 1012
+# Listening socket file descriptor passed to the new process by the one it replaces
+LISTEN_FD_ENV = "WS_LISTEN_FD"
+# Pipe the new process writes to once it serves, the one it replaces drains only then
+READY_FD_ENV = "WS_READY_FD"
+# systemd socket activation passes its sockets from file descriptor 3
+SD_LISTEN_FDS_START = 3
+
+RESTART_REASON = "Service restart, retry after {:.1f} s"
+RESTART_REASON_PATTERN = re.compile(r"retry after ([0-9.]+) s")
+
+
+def inherited_socket():
+    """ Listening socket inherited from the previous process (WS_LISTEN_FD) or from systemd (LISTEN_FDS), or None """
+    fd = os.environ.get(LISTEN_FD_ENV)
+    if fd is None and os.getenv("LISTEN_FDS") and os.getenv("LISTEN_PID") == str(os.getpid()):
+        fd = SD_LISTEN_FDS_START
+    if fd is None:
+        return None
+    sock = socket.socket(fileno=int(fd))
+    sock.setblocking(False)
+    return sock
+
+
+def listen_options(ip, port, reuse_port=False):
+    """ websockets.serve options listening on the inherited socket if any, else binding ip:port """
+    sock = inherited_socket()
+    if sock is not None:
+        return {"sock": sock}
+    return {"host": ip, "port": port, "reuse_port": reuse_port}
+
+
+def reconnect_hint(websocket):
+    """ Delay asked by a server closing the connection for a restart, None for any other close """
+    if websocket is None or websocket.close_code != CLOSE_SERVICE_RESTART:
+        return None
+    match = RESTART_REASON_PATTERN.search(websocket.close_reason or "")
+    return float(match.group(1)) if match else None
+
+
+class Drain:
+    """
+    Shutdown of a server without a reconnection storm.
+    SIGTERM or SIGINT start the drain: the server stops accepting connections, then closes the open ones with
+    code 1012 one after the other, in random order, spread over period seconds. Each close reason carries a
+    reconnect hint, a random delay up to reconnect_spread seconds, that relay_client.py waits before reconnecting.
+    A second signal closes the remaining connections at once.
+    SIGUSR2 first starts the same command in a new process inheriting the listening socket (WS_LISTEN_FD), so the
+    new build accepts the connections while this one drains: no refused connection during a deploy. This process
+    drains once the new one reported it serves (WS_READY_FD); if it exits or is not ready within handover_timeout
+    seconds, it is stopped and this one keeps serving.
+    """
+    def __init__(self, period=10, reconnect_spread=5, handover_timeout=30):
+        self.period = period
+        self.reconnect_spread = reconnect_spread
+        self.handover_timeout = handover_timeout
+        self.draining = False
+        self._requested = None
+        self._hurry = None
+
+    def install(self, handover=True):
+        """ Install the signal handlers, call it from the running loop """
+        loop = asyncio.get_running_loop()
+        self._requested = loop.create_future()
+        self._hurry = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.request)
+        if handover:
+            loop.add_signal_handler(signal.SIGUSR2, self.request, True)
+
+    def request(self, handover=False):
+        if self._requested.done():
+            self._hurry.set()
+        else:
+            self._requested.set_result(handover)
+
+    async def run(self, server):
+        """ Serve until a drain is requested, returns once every connection is closed """
+        ready()
+        while await self._requested:
+            if await self.handover(server) or self._hurry.is_set():
+                break
+            # The new process failed, keep serving until the next signal
+            self._requested = asyncio.get_running_loop().create_future()
+        await self.drain(server)
+
+    async def handover(self, server):
+        """ Start this server again in a new process listening on the same socket, True once it serves """
+        fd = server.sockets[0].fileno()
+        read_fd, write_fd = os.pipe()
+        process = subprocess.Popen([sys.executable] + sys.argv, pass_fds=(fd, write_fd),
+                                   env={**os.environ, LISTEN_FD_ENV: str(fd), READY_FD_ENV: str(write_fd)})
+        os.close(write_fd)
+        print(f"Handing the listening socket over to process {process.pid}")
+        if await asyncio.to_thread(_wait_ready, read_fd, self.handover_timeout):
+            return True
+        print(f"Process {process.pid} did not start serving, handover cancelled")
+        process.terminate()
+        return False
+
+    async def drain(self, server):
+        self.draining = True
+        # Stops accepting, handshakes in progress are answered with HTTP 503
+        server.close(close_connections=False)
+        connections = list(server.connections)
+        random.shuffle(connections)
+        print(f"Draining {len(connections)} connections over {self.period} s")
+        gap = self.period / len(connections) if connections else 0
+        closing = []
+        for connection in connections:
+            reason = RESTART_REASON.format(random.uniform(0, self.reconnect_spread))
+            closing.append(asyncio.create_task(connection.close(CLOSE_SERVICE_RESTART, reason)))
+            if gap and not self._hurry.is_set():
+                try:
+                    await asyncio.wait_for(self._hurry.wait(), gap)
+                except asyncio.TimeoutError:
+                    pass
+        await server.wait_closed()
+        print("Drained")
+
+
+def ready():
+    """ Tell the process handing its socket over that this one serves, no-op when not started by a handover """
+    fd = os.environ.pop(READY_FD_ENV, None)
+    if fd is not None:
+        os.write(int(fd), b"1")
+        os.close(int(fd))
+
+
+def _wait_ready(fd, timeout):
+    """ Whether the new process wrote to the ready pipe before timeout, its exit closes the pipe empty """
+    try:
+        readable, _, _ = select.select([fd], [], [], timeout)
+        return bool(readable) and os.read(fd, 1) == b"1"
+    finally:
+        os.close(fd)
+
+
+def drain_from_env():
+    """
+    WS_DRAIN_PERIOD (seconds to close all the connections), WS_RECONNECT_SPREAD (seconds of reconnect hints) and
+    WS_HANDOVER_TIMEOUT (seconds for the new process to serve after SIGUSR2)
+    """
+    return Drain(
+        period=float(os.getenv("WS_DRAIN_PERIOD", 10)),
+        reconnect_spread=float(os.getenv("WS_RECONNECT_SPREAD", 5)),
+        handover_timeout=float(os.getenv("WS_HANDOVER_TIMEOUT", 30)),
+    )
@@ -0,0 +1,109 @@
+""" Fan-out engine shared by the websocket relay servers """
+import asyncio
+import websockets
+from outbound_queue import OutboundQueue, DROP_OLDEST, status_key
+import wire_protocol
+
+
+class Fanout:
+    """
+    Keeps the set of connected clients and relays messages to them.
+    The recipient set is updated on connect/disconnect only, so relaying a message never rescans the clients.
+    Each message is encoded once and pushed to every write buffer with websockets.broadcast,
+    the sender never waits for the slowest peer to drain.
+    Clients whose write buffer is full get the message in their bounded OutboundQueue instead.
+    """
+    def __init__(self, queue_depth=64, queue_bytes=1024 * 1024, policy=DROP_OLDEST):
+        self._queues = {}  # websocket -> OutboundQueue
+        self._writers = {}  # websocket -> writer task
+        self.queue_depth = queue_depth
+        self.queue_bytes = queue_bytes
+        self.policy = policy
+        self.dropped = 0
+        self.overflow_disconnects = 0
+        # Frames handed to the clients and their size, a text frame is counted in characters (JSON is ASCII)
+        self.messages_out = 0
+        self.bytes_out = 0
+
+    def __len__(self):
+        return len(self._queues)
+
+    def __contains__(self, websocket):
+        return websocket in self._queues
+
+    def add(self, websocket):
+        """ Register a newly connected client as a recipient """
+        if websocket in self._queues:
+            return
+        queue = OutboundQueue(websocket, self.queue_depth, self.queue_bytes, self.policy)
+        queue.binary = wire_protocol.uses_binary(websocket)
+        self._queues[websocket] = queue
+        self._writers[websocket] = asyncio.create_task(queue.run())
+
+    def discard(self, websocket):
+        """ Forget a disconnected client, no-op if it was never registered """
+        queue = self._queues.pop(websocket, None)
+        if queue is None:
+            return
+        self._writers.pop(websocket).cancel()
+        self.dropped += queue.dropped + queue.depth
+        self.overflow_disconnects += queue.overflow_disconnect
+
+    def queue(self, websocket):
+        return self._queues.get(websocket)
+
+    def broadcast(self, message, sender=None, recipients=None):
+        """
+        Relay the message to every recipient except the sender, without awaiting any socket.
+        Recipients default to all the connected clients, a room can pass its own members instead.
+        A wire_protocol.Message goes as JSON or as a binary frame depending on each client, a str or bytes as is.
+        """
+        routed = isinstance(message, wire_protocol.Message)
+        direct = []
+        direct_binary = []
+        encoded = {}  # binary format -> (payload, text, key) for the slow clients
+        if recipients is None:
+            queues = self._queues.items()
+        else:
+            queues = ((ws, self._queues[ws]) for ws in recipients if ws in self._queues)
+        for ws, queue in queues:
+            if ws is sender:
+                continue
+            binary = routed and queue.binary
+            if queue.is_idle():
+                (direct_binary if binary else direct).append(ws)
+                continue
+            if binary not in encoded:
+                # Encoded once per format for all the slow clients
+                frame = message if not routed else message.as_binary() if binary else message.as_json()
+                text = isinstance(frame, str)
+                encoded[binary] = (frame.encode() if text else frame, text, status_key(message, sender))
+            if queue.put(*encoded[binary]):
+                self.messages_out += 1
+                self.bytes_out += len(encoded[binary][0])
+        if direct:
+            frame = message.as_json() if routed else message
+            websockets.broadcast(direct, frame)
+            self.messages_out += len(direct)
+            self.bytes_out += len(direct) * len(frame)
+        if direct_binary:
+            frame = message.as_binary()
+            websockets.broadcast(direct_binary, frame)
+            self.messages_out += len(direct_binary)
+            self.bytes_out += len(direct_binary) * len(frame)
+
+    def queue_depths(self):
+        return (queue.depth for queue in self._queues.values())
+
+    def stats(self):
+        """ Queue depth and drop counters, including clients already disconnected """
+        depths = [queue.depth for queue in self._queues.values()]
+        return {
+            "clients": len(self._queues),
+            "queued_frames": sum(depths),
+            "queued_bytes": sum(queue.bytes for queue in self._queues.values()),
+            "max_queue_depth": max(depths, default=0),
+            "dropped": self.dropped + sum(queue.dropped for queue in self._queues.values()),
+            "overflow_disconnects": self.overflow_disconnects
+            + sum(queue.overflow_disconnect for queue in self._queues.values()),
+        }
@@ -0,0 +1,103 @@
+""" Heartbeats of all the connections from one timer wheel, and eviction of the peers gone silent """
+import asyncio
+import os
+import time
+import websockets
+
+
+class Heartbeat:
+    """
+    Replaces the keepalive task websockets runs for every connection (serve with ping_interval=None).
+    The sessions are spread over the slots of a wheel turning once per interval: a single task visits one slot
+    per tick, pings the connections of the slot that were silent for a whole interval and evicts the ones that
+    neither sent a message nor answered a ping for idle_timeout seconds.
+    An evicted connection is aborted without closing handshake, a half-open socket would never answer it,
+    and its handler cleans up as for any lost connection.
+    The wheel never waits for a socket: pings are sent from their own tasks, and a connection whose write buffer
+    is over its limit (the peer stopped reading) is not pinged, the ping could not reach it before the idle timeout.
+    """
+    def __init__(self, interval=20, idle_timeout=60, slots=64):
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self._slots = [set() for _ in range(slots)]
+        self._next_slot = 0
+        self._task = None
+        self.pings = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return sum(len(slot) for slot in self._slots)
+
+    def start(self):
+        """ Start the wheel, call it from the running loop, no-op when the interval is 0 """
+        if self.interval and self._task is None:
+            self._task = asyncio.create_task(self._turn())
+
+    def add(self, session):
+        session.last_seen = time.monotonic()
+        session.pong = None
+        session.wheel_slot = self._next_slot
+        self._slots[self._next_slot].add(session)
+        self._next_slot = (self._next_slot + 1) % len(self._slots)
+
+    def discard(self, session):
+        if session.wheel_slot is not None:
+            self._slots[session.wheel_slot].discard(session)
+            session.wheel_slot = None
+        if session.pong is not None:
+            session.pong.cancel()
+            session.pong = None
+
+    async def _turn(self):
+        tick = self.interval / len(self._slots)
+        index = 0
+        while True:
+            await asyncio.sleep(tick)
+            self._visit(self._slots[index])
+            index = (index + 1) % len(self._slots)
+
+    def _visit(self, slot):
+        now = time.monotonic()
+        for session in list(slot):
+            pong = session.pong
+            if pong is not None and pong.done():
+                session.pong = None
+                if not pong.cancelled() and pong.result():
+                    session.last_seen = max(session.last_seen, now - self.interval)
+            if now - session.last_seen > self.idle_timeout:
+                self.evict(session)
+            elif session.pong is None and now - session.last_seen >= self.interval and not _backed_up(session.websocket):
+                session.pong = asyncio.create_task(_ping(session.websocket))
+                self.pings += 1
+
+    def evict(self, session):
+        self.evictions += 1
+        self.discard(session)
+        transport = session.websocket.transport
+        if transport is not None:
+            transport.abort()
+
+    def stats(self):
+        return {"connections": len(self), "pings": self.pings, "evictions": self.evictions}
+
+
+async def _ping(websocket):
+    """ Ping and wait for the pong, True once answered. May wait for the write buffer to drain first """
+    try:
+        await (await websocket.ping())
+        return True
+    except websockets.ConnectionClosed:
+        return False
+
+
+def _backed_up(websocket):
+    transport = websocket.transport
+    return transport is not None and transport.get_write_buffer_size() > websocket.write_limit[0]
+
+
+def heartbeat_from_env():
+    """ WS_HEARTBEAT_INTERVAL (seconds, 0 disables the heartbeats) and WS_IDLE_TIMEOUT (seconds) """
+    return Heartbeat(
+        interval=float(os.getenv("WS_HEARTBEAT_INTERVAL", 20)),
+        idle_timeout=float(os.getenv("WS_IDLE_TIMEOUT", 60)),
+    )
@@ -0,0 +1,50 @@
+""" Recent messages of a room, numbered, replayed to the clients resuming after a reconnection """
+import collections
+import itertools
+import random
+
+# The numbering of each history starts at a random epoch, a multiple of EPOCH_SPAN below 2**31 (the seq of a
+# binary frame has 32 bits): a seq from the history of another worker, node or process is told apart from this one
+EPOCH_SPAN = 1 << 20
+
+
+class History:
+    """
+    Ring buffer of the last messages of a room, bounded by max_messages and max_bytes (text size).
+    Every message appended gets the next sequence number of the room, counted from a random epoch.
+    The stored messages are the ones broadcast, a replay reuses the JSON or binary frames they already encoded.
+    Each message is kept with the identity of its sender, who never receives it again on a replay.
+    """
+    def __init__(self, max_messages=256, max_bytes=256 * 1024):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.epoch = random.randrange(1, (1 << 31) // EPOCH_SPAN) * EPOCH_SPAN
+        self.seq = self.epoch
+        self.bytes = 0
+        self._messages = collections.deque()  # (wire_protocol.Message, sender), consecutive seq
+
+    def __len__(self):
+        return len(self._messages)
+
+    def append(self, message, sender=None):
+        """ Number the message in this room and keep it with its sender, returns the numbered message to broadcast """
+        self.seq += 1
+        message = message.sequenced(self.seq)
+        self._messages.append((message, sender))
+        self.bytes += message.size()
+        while len(self._messages) > self.max_messages or (self.bytes > self.max_bytes and len(self._messages) > 1):
+            self.bytes -= self._messages.popleft()[0].size()
+        return message
+
+    def since(self, seq, sender=None):
+        """
+        Messages after seq still in the buffer, older ones are lost, without the ones sent by sender.
+        None if seq is not from this history (another worker or node, or before a restart): nothing can be replayed.
+        """
+        if not self.epoch <= seq <= self.seq:
+            return None
+        if not self._messages:
+            return []
+        first = self._messages[0][0].seq
+        return [message for message, origin in itertools.islice(self._messages, max(0, seq + 1 - first), None)
+                if sender is None or origin != sender]
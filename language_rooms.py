@@ -0,0 +1,310 @@
+""" Language rooms: the server translates each utterance once per listening language """
+import asyncio
+import collections
+import json
+import logging
+from history import History
+from live_transcript import TranscriptAssembler
+from translate_agent import LANGUAGES
+import wire_protocol
+from wire_protocol import Message, SPEECH, STATUS, TRANSLATED
+
+
+class LanguageRooms:
+    """
+    Groups the connected clients by the language they declared with a "join" message:
+        {"type": "join", "language": "French", "voice": "Female"}
+    A "speech" message is translated once for each room and the room receives the translated text,
+    marked with "translated": true so the clients do not translate it again.
+    Clients that never joined stay in the None room and receive the original message, as before.
+    Only the languages of translate_agent.LANGUAGES have a room, a join to any other language is ignored: the rooms,
+    their histories and translation workers are bounded whatever the clients send.
+    Without a TranslateAgent every room receives the original message.
+    Speech and status messages can also come as wire_protocol binary frames, each client receives its own format.
+    With history_size > 0 every speech relayed to a room is numbered ("seq") and kept in the History of the room.
+    A client back after a reconnection joins its room again and sends the last seq it received:
+        {"type": "resume", "seq": 42}
+    and gets the speech messages it missed, except its own (session.Session.sender). A seq numbered by another
+    history (another worker or node, a restarted server) replays nothing. Rooms left empty keep recording the
+    original messages meanwhile, the client translates them by itself.
+    Live transcript "chunk" messages (see live_transcript.py) are relayed untranslated to every room and never
+    kept in the history, the "speech" message committing the utterance is translated and numbered as any other.
+    With a TranslateAgent, each translated room translates the stable prefix of the chunks received so far in a
+    TranslationSession, the commit only has the end of the utterance left to translate.
+    At most max_pending utterances wait for the translation of a room: past that the room gets the original text,
+    translated by its clients, and no speculative translation starts for it until the backlog is down.
+    With a backplane (bus), each utterance is translated once, by the worker or node that received it: it shares the
+    original and every translated room message, the others only relay them to their clients. Each worker announces
+    the rooms it has members in, the receiving one translates for the rooms listened to anywhere.
+    """
+    def __init__(self, fanout, agent=None, history_size=0, history_bytes=256 * 1024, max_pending=16):
+        self._fanout = fanout
+        self._agent = agent
+        self._max_pending = max_pending
+        self._history_size = history_size
+        self._history_bytes = history_bytes
+        self._histories = {}  # language -> History
+        self._rooms = {None: set()}  # language -> websockets
+        self._members = {}  # websocket -> session.Session
+        self._pending = {}  # language -> asyncio.Queue of utterances to translate
+        self._workers = {}  # language -> translation task
+        self._transcripts = TranscriptAssembler(max_open=64)  # Live utterances being spoken
+        self._sessions = collections.OrderedDict()  # (websocket, utterance) -> {language: TranslationSession}
+        self._remote = {}  # node id -> languages listened to on the other workers or nodes
+        self._announced = []
+        self.bus = None  # backplane.Backplane shared with the other workers or nodes, see deliver
+        self._add_room(None)
+
+    def languages(self):
+        return [language for language, members in self._rooms.items() if language and members]
+
+    def listened(self):
+        """ Languages with members here or on another worker or node """
+        return set(self.languages()).union(*self._remote.values())
+
+    def _add_room(self, language):
+        self._rooms.setdefault(language, set())
+        if self._history_size and language not in self._histories:
+            self._histories[language] = History(self._history_size, self._history_bytes)
+
+    def add(self, session):
+        """ A new client starts in the untranslated room """
+        session.language = None
+        self._members[session.websocket] = session
+        self._rooms[None].add(session.websocket)
+
+    def discard(self, websocket):
+        session = self._members.pop(websocket, None)
+        if session is not None:
+            self._rooms[session.language].discard(websocket)
+            self._announce()
+
+    def language(self, websocket):
+        session = self._members.get(websocket)
+        return session.language if session is not None else None
+
+    def join(self, websocket, language, voice=None):
+        """ Move the client to the room of its language, the translation worker of the room starts with it """
+        session = self._members.get(websocket)
+        if session is None or language not in LANGUAGES:
+            return
+        self._rooms[session.language].discard(websocket)
+        session.language = language
+        session.voice = voice
+        self._open_room(language)
+        self._rooms[language].add(websocket)
+        self._announce()
+        logging.info("Client %s joined room %s (%s voice)", session.address, language, voice)
+
+    def _open_room(self, language):
+        self._add_room(language)
+        if language not in self._workers:
+            self._pending[language] = asyncio.Queue(maxsize=self._max_pending)
+            self._workers[language] = asyncio.create_task(self._translate_room(language))
+
+    def route(self, websocket, message):
+        """
+        Handle a message received from a client: join a room, relay a speech to every room or broadcast it,
+        on this worker and through the bus. A binary wire_protocol frame keeps its body for the binary clients,
+        one that is not valid UTF-8 is dropped. Returns False if the message was not relayed.
+        """
+        if not isinstance(message, str):
+            routed = Message.from_binary(message)
+            if routed is None or routed.type not in (SPEECH, STATUS):
+                # Auth frames, unknown and invalid binary frames are never relayed
+                return False
+            if routed.type == SPEECH:
+                self.relay_speech(websocket, routed)
+            else:
+                self._fanout.broadcast(routed, sender=websocket)
+                self._share({"relay": "broadcast", "message": routed.as_json()})
+            return True
+
+        try:
+            data = json.loads(message)
+        except json.JSONDecodeError:
+            data = None
+        if not isinstance(data, dict):
+            self._fanout.broadcast(message, sender=websocket)
+            self._share({"relay": "broadcast", "message": message})
+            return True
+
+        if data.get("type") == "join":
+            self.join(websocket, data.get("language"), data.get("voice"))
+            return False
+        if data.get("type") == "resume":
+            if isinstance(data.get("seq"), int):
+                self.resume(websocket, data["seq"])
+            return False
+        if data.get("type") == "chunk":
+            self.relay_chunk(websocket, message, data)
+            self._share({"relay": "broadcast", "message": message})
+            return True
+        routed = Message.from_json(message, data) if data.get("type") in ("speech", "status") else None
+        if routed is not None and routed.type == SPEECH:
+            self.relay_speech(websocket, routed)
+            return True
+        self._fanout.broadcast(routed or message, sender=websocket)
+        self._share({"relay": "broadcast", "message": message})
+        return True
+
+    def deliver(self, message):
+        """
+        Handle a message of the bus, shared by another worker or node:
+            {"relay": "broadcast", "message": ...}  relayed to every client
+            {"relay": "speech", "message": ..., "origin": ..., "translated": [...]}  original speech, relayed to the
+                rooms the sender does not translate
+            {"relay": "room", "language": ..., "message": ..., "origin": ...}  speech translated for a room
+            {"relay": "rooms", "node": ..., "languages": [...]}  rooms with members on the sender
+        """
+        try:
+            data = json.loads(message)
+            kind = data["relay"]
+            if kind == "rooms":
+                self._update_remote(data["node"], data["languages"])
+                return
+            text = data["message"]
+            if kind == "broadcast":
+                # Status messages keep reaching the binary clients as binary frames
+                parsed = wire_protocol.parse(text)
+                routed = Message.from_json(text, parsed) if isinstance(parsed, dict) else None
+                self._fanout.broadcast(routed if routed is not None and routed.type == STATUS else text)
+                return
+            routed = Message.from_json(text, json.loads(text))
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            logging.warning("Invalid message from the bus dropped: %r", e)
+            return
+        if routed is None or routed.type != SPEECH:
+            logging.warning("Invalid %s message from the bus dropped", kind)
+        elif kind == "speech":
+            self._relay_original(routed, None, data.get("origin"), data.get("translated") or ())
+        elif kind == "room" and data.get("language") in self._rooms:
+            self.publish(data["language"], routed, None, data.get("origin"))
+
+    def _share(self, data):
+        if self.bus is not None:
+            self.bus.publish(json.dumps(data))
+
+    def _announce(self, force=False):
+        """ Share the rooms with members here when they change, or with a node that does not know them yet """
+        languages = sorted(self.languages())
+        if self.bus is None or languages == self._announced and not force:
+            return
+        self._announced = languages
+        self._share({"relay": "rooms", "node": self.bus.node_id.hex(), "languages": languages})
+
+    def _update_remote(self, node, languages):
+        known = node in self._remote
+        languages = {language for language in languages if language in LANGUAGES}
+        self._remote[node] = languages
+        for language in languages:
+            self._open_room(language)
+        if not known and self._announced:
+            self._announce(force=True)
+
+    def resume(self, websocket, seq):
+        """ Replay to the client the speech messages of its room after seq, from the frames already encoded """
+        session = self._members.get(websocket)
+        history = self._histories.get(session.language) if session is not None else None
+        if history is None:
+            return
+        session.resumed_seq = seq
+        missed = history.since(seq, session.sender)
+        if missed is None:
+            logging.info("Client %s resumed room %s after seq %s of another history: nothing replayed",
+                         session.address, session.language, seq)
+            return
+        for message in missed:
+            self._fanout.broadcast(message, recipients=(websocket,))
+        logging.info("Client %s resumed room %s after seq %s: %d messages replayed",
+                     session.address, session.language, seq, len(missed))
+
+    def publish(self, language, message, sender=None, origin=None):
+        """
+        Broadcast a speech to a room, numbered and kept in the room history if enabled.
+        origin is the identity of the sender (session.Session.sender), skipped when the history is replayed to it.
+        """
+        history = self._histories.get(language)
+        if history is not None:
+            message = history.append(message, origin)
+        self._fanout.broadcast(message, sender=sender, recipients=self._rooms[language])
+
+    def relay_chunk(self, websocket, message, data):
+        """ Relay a live transcript chunk to this worker's rooms, translated rooms start translating the utterance ahead """
+        self._fanout.broadcast(message, sender=websocket)
+        if self._agent is None:
+            return
+        source = self._transcripts.add(data, websocket)
+        if source is None:
+            return
+        key = (websocket, data["utterance"])
+        sessions = self._sessions.get(key)
+        if sessions is None:
+            sessions = self._sessions[key] = {}
+            while len(self._sessions) > self._transcripts.max_open:
+                self._sessions.popitem(last=False)
+        source_language = self.language(websocket)
+        for language in self.listened():
+            if language == source_language or self._pending[language].full():
+                continue
+            if language not in sessions:
+                sessions[language] = self._agent.session(language)
+            sessions[language].update(source)
+
+    def relay_speech(self, websocket, message):
+        """ Send the original text to the untranslated room and to the speaker's own language, queue the others """
+        source_language = self.language(websocket)
+        session = self._members.get(websocket)
+        origin = session.sender if session is not None else None
+        if message.utterance is not None:
+            self._transcripts.commit({"utterance": message.utterance}, websocket)
+        translated = []
+        for language in self.listened() if self._agent is not None else ():
+            if language == source_language:
+                continue
+            if self._pending[language].full():
+                logging.info("Translation backlog of %s full, original text relayed", language)
+                continue
+            translated.append(language)
+        self._share({"relay": "speech", "message": message.as_json(), "origin": origin, "translated": translated})
+        self._relay_original(message, websocket, origin, translated)
+        for language in translated:
+            self._pending[language].put_nowait((websocket, origin, message))
+
+    def _relay_original(self, message, sender, origin, translated):
+        """ Publish the original speech to the rooms of this worker that do not get a translation """
+        self.publish(None, message, sender, origin)
+        for language, members in self._rooms.items():
+            if language is None or language in translated or not members and language not in self._histories:
+                continue
+            # An empty room records the original only, for its clients resuming later
+            self.publish(language, message, sender, origin)
+
+    async def _translate_room(self, language):
+        """ Translation worker of a room, utterances are translated in order and once for the whole room """
+        pending = self._pending[language]
+        while True:
+            websocket, origin, message = await pending.get()
+            if language not in self.listened():
+                self._publish_room(language, message, websocket, origin)
+                continue
+            sessions = self._sessions.get((websocket, message.utterance)) if message.utterance is not None else None
+            session = sessions.pop(language, None) if sessions else None
+            try:
+                if session is not None:
+                    # Most of the utterance was translated while it was spoken
+                    translated = await session.commit(message.text)
+                else:
+                    translated = await asyncio.to_thread(self._agent.translate, message.text, language)
+            except Exception as e:
+                # Clients translate by themselves what the server could not
+                logging.info("Translation to %s failed: %s", language, e)
+                self._publish_room(language, message, websocket, origin)
+                continue
+            self._publish_room(language, Message(SPEECH, translated, seq=message.seq, flags=TRANSLATED,
+                                                 language=language, utterance=message.utterance), websocket, origin)
+
+    def _publish_room(self, language, message, sender, origin):
+        """ Publish the speech of a translated room here and on the other workers or nodes """
+        self.publish(language, message, sender, origin)
+        self._share({"relay": "room", "language": language, "message": message.as_json(), "origin": origin})
@@ -0,0 +1,81 @@
+""" Live transcripts: an utterance streamed as numbered chunks while spoken, then committed as a speech message """
+import collections
+import itertools
+import json
+import uuid
+
+
+class Utterances:
+    """
+    Speaker side: ids and chunk numbers of the utterances of one client.
+        {"type": "chunk", "utterance": "<id>", "index": 1, "text": "<new words>"}  for each partial transcript
+        {"type": "speech", "utterance": "<id>", "chunks": 3, "text": "<whole utterance>"}  at the endpoint
+    The commit is a regular speech message, translated and kept in the room history by the server and played
+    by the clients ignoring the chunks.
+    """
+    def __init__(self):
+        self._client = uuid.uuid4().hex[:8]
+        self._numbers = itertools.count(1)
+        self._current = None
+        self._chunks = 0
+
+    def chunk(self, text, **fields):
+        """ JSON chunk message of the partial transcript text, starts a new utterance if needed """
+        if self._current is None:
+            self._current = f"{self._client}-{next(self._numbers)}"
+            self._chunks = 0
+        self._chunks += 1
+        return json.dumps({"type": "chunk", "utterance": self._current, "index": self._chunks, "text": text, **fields})
+
+    def commit(self, text, **fields):
+        """ JSON speech message closing the current utterance with its final text """
+        if self._current is None:
+            self._current = f"{self._client}-{next(self._numbers)}"
+        message = {"type": "speech", "utterance": self._current, "chunks": self._chunks, "text": text, **fields}
+        self._current = None
+        self._chunks = 0
+        return json.dumps(message)
+
+
+class TranscriptAssembler:
+    """
+    Listener side: rebuilds the utterances of the other speakers from their chunks until their commit.
+    Chunks are assembled in index order, one arriving early waits for the missing ones; a chunk more than max_ahead
+    indexes past the next expected one is dropped, so at most max_ahead chunks wait per utterance. An utterance
+    never committed (its speaker left) is forgotten once max_open newer ones are open.
+    The server passes the connection of the speaker as source: utterance ids are chosen by the clients, a client
+    cannot add chunks to the utterance of another one.
+    """
+    def __init__(self, max_open=16, max_ahead=8):
+        self.max_open = max_open
+        self.max_ahead = max_ahead
+        self._open = collections.OrderedDict()  # (source, utterance) -> [assembled text, next index, {index: early text}]
+
+    def __len__(self):
+        return len(self._open)
+
+    def add(self, data, source=None):
+        """ Add a received chunk message, returns the text assembled so far, None if it did not grow """
+        utterance, index, text = data.get("utterance"), data.get("index"), data.get("text")
+        if not isinstance(utterance, str) or not isinstance(index, int) or not isinstance(text, str):
+            return None
+        state = self._open.get((source, utterance))
+        if state is None:
+            if index > self.max_ahead:
+                return None
+            state = self._open[(source, utterance)] = ["", 1, {}]
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        if index < state[1] or index > state[1] + self.max_ahead:
+            return None  # Duplicate, or too far ahead
+        state[2][index] = text
+        if state[1] not in state[2]:
+            return None
+        while state[1] in state[2]:
+            state[0] += state[2].pop(state[1])
+            state[1] += 1
+        return state[0]
+
+    def commit(self, data, source=None):
+        """ Close the utterance of a received speech message, if it was streamed """
+        self._open.pop((source, data.get("utterance")), None)
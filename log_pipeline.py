@@ -0,0 +1,129 @@
+""" Logging of the servers from a background thread, so disk writes and formatting stay off the event loop """
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+
+# Loggers of the servers: connection events and bodies of the relayed messages
+CONNECTIONS = "relay.connections"
+MESSAGES = "relay.messages"
+
+
+class SampleFilter(logging.Filter):
+    """ Keep a fraction of the records, message bodies are logged for 1 in 1/rate messages on average """
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return self.rate >= 1 or random.random() < self.rate
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands the record to the writer thread as is: unlike QueueHandler, the message is not formatted here.
+    Records are dropped (and counted) when the writer is too far behind instead of blocking the loop.
+    """
+    def __init__(self, records):
+        super().__init__(records)
+        self.writer = None
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Called by logging.shutdown() at exit, the records still queued are written first
+        if self.writer is not None:
+            self.writer.stop()
+        super().close()
+
+
+class BatchWriter:
+    """ Writer thread: formats the queued records and writes them in batches, one flush per batch """
+    def __init__(self, records, filename, formatter, console=False, batch_size=256, flush_interval=0.2):
+        self._records = records
+        self._filename = filename
+        self._formatter = formatter
+        self._console = console
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._thread = None
+        self.written = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._records.put(None)
+            self._thread.join()
+
+    def _run(self):
+        with open(self._filename, "a", encoding="utf-8") as stream:
+            while True:
+                batch = [self._records.get()]
+                deadline = time.monotonic() + self._flush_interval
+                while batch[-1] is not None and len(batch) < self._batch_size:
+                    try:
+                        batch.append(self._records.get(timeout=max(0, deadline - time.monotonic())))
+                    except queue.Empty:
+                        break
+                stopping = batch[-1] is None
+                if stopping:
+                    batch.pop()
+                lines = [self._formatter.format(record) for record in batch]
+                if lines:
+                    stream.write("\n".join(lines) + "\n")
+                    stream.flush()
+                    if self._console:
+                        console = [line for line, record in zip(lines, batch) if record.name == CONNECTIONS]
+                        if console:
+                            print("\n".join(console), flush=True)
+                self.written += len(lines)
+                if stopping:
+                    return
+
+
+def setup(filename="server.log", level=logging.INFO, message_level=logging.INFO, message_sample=1.0,
+          console=True, queue_size=10000, batch_size=256, flush_interval=0.2):
+    """
+    Route every log record to a background BatchWriter appending to filename.
+    Message bodies go through the MESSAGES logger: message_level and message_sample select how many are kept,
+    they are formatted by the writer thread only. Connection events are also printed when console is True.
+    """
+    records = queue.Queue(queue_size)
+    formatter = logging.Formatter("%(asctime)s %(message)s")
+    handler = DeferredQueueHandler(records)
+    root = logging.getLogger()
+    for previous in root.handlers[:]:
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    messages = logging.getLogger(MESSAGES)
+    messages.setLevel(message_level)
+    if message_sample < 1:
+        messages.addFilter(SampleFilter(message_sample))
+
+    handler.writer = BatchWriter(records, filename, formatter, console, batch_size, flush_interval)
+    handler.writer.start()
+
+    def restart_in_child():
+        # A forked worker has no writer thread, it gets its own queue and writer
+        handler.queue = queue.Queue(queue_size)
+        handler.writer = BatchWriter(handler.queue, filename, formatter, console, batch_size, flush_interval)
+        handler.writer.start()
+
+    os.register_at_fork(after_in_child=restart_in_child)
+    return handler
@@ -0,0 +1,153 @@
+""" Relay metrics in the Prometheus text format, served on the websocket port through process_request """
+import asyncio
+import bisect
+import gc
+import http
+import os
+import time
+from urllib.parse import urlparse
+
+# Upper bounds in seconds of the latency and pause buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Upper bounds in frames of the per-connection queue depth buckets
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class Histogram:
+    """ Fixed buckets allocated once, observing a value is a bisect and two additions """
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """ Upper bound of the bucket holding the q quantile, +Inf past the last bound """
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return "+Inf"
+
+    def render(self, name, description, lines, labels=""):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels[:-1]}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels[:-1]}}} {self.count}")
+
+
+class RelayMetrics:
+    """
+    Counters of one server process, updated in place by the handler on the hot path (no lock, nothing allocated):
+        metrics.messages_in += 1; metrics.bytes_in += len(message); metrics.fanout_latency.observe(seconds)
+    Messages and bytes out come from the Fanout, queue depths are read from it at scrape time.
+    A background task measures the event loop lag and a gc callback the collection pauses.
+    Heartbeat pings and idle evictions come from the heartbeat.Heartbeat, if any.
+    GET <path> on the websocket port returns the metrics instead of upgrading. With WS_WORKERS > 1 each scrape
+    is answered by one of the workers, every sample carries its pid.
+    """
+    def __init__(self, fanout, path="/metrics", lag_interval=0.5, heartbeat=None):
+        self._fanout = fanout
+        self._heartbeat = heartbeat
+        self.path = path
+        self.lag_interval = lag_interval
+        self.connections = 0
+        self.connections_total = 0
+        self.auth_failures = 0
+        self.messages_in = 0
+        self.bytes_in = 0
+        self.throttled = 0
+        self.rate_limit_disconnects = 0
+        self.fanout_latency = Histogram(LATENCY_BUCKETS)
+        self.loop_lag = Histogram(LATENCY_BUCKETS)
+        self.gc_pauses = Histogram(LATENCY_BUCKETS)
+        self._gc_started = None
+        self._lag_task = None
+
+    def start(self):
+        """ Start the loop lag probe and the gc pause callback, call it from the running loop """
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._probe_loop_lag())
+            gc.callbacks.append(self._on_gc)
+
+    def connected(self):
+        self.connections += 1
+        self.connections_total += 1
+
+    def disconnected(self):
+        self.connections -= 1
+
+    async def _probe_loop_lag(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag.observe(max(0.0, time.perf_counter() - started - self.lag_interval))
+
+    def _on_gc(self, phase, info):
+        if phase == "start":
+            self._gc_started = time.perf_counter()
+        elif self._gc_started is not None:
+            self.gc_pauses.observe(time.perf_counter() - self._gc_started)
+            self._gc_started = None
+
+    def render(self):
+        labels = f'pid="{os.getpid()}",'
+        pid = labels[:-1]
+        lines = []
+
+        def sample(name, kind, description, value):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name}{{{pid}}} {value}")
+
+        stats = self._fanout.stats()
+        sample("relay_connections", "gauge", "Open websocket connections", self.connections)
+        sample("relay_connections_total", "counter", "Accepted websocket connections", self.connections_total)
+        sample("relay_auth_failures_total", "counter", "Rejected authentications", self.auth_failures)
+        sample("relay_messages_in_total", "counter", "Messages received from the clients", self.messages_in)
+        sample("relay_bytes_in_total", "counter", "Bytes received from the clients", self.bytes_in)
+        sample("relay_throttled_messages_total", "counter", "Messages over the rate limit, reading paused",
+               self.throttled)
+        sample("relay_rate_limit_disconnects_total", "counter", "Clients disconnected for flooding",
+               self.rate_limit_disconnects)
+        sample("relay_messages_out_total", "counter", "Frames relayed to the clients", self._fanout.messages_out)
+        sample("relay_bytes_out_total", "counter", "Bytes relayed to the clients", self._fanout.bytes_out)
+        sample("relay_queued_frames", "gauge", "Frames waiting in the outbound queues", stats["queued_frames"])
+        sample("relay_queued_bytes", "gauge", "Bytes waiting in the outbound queues", stats["queued_bytes"])
+        sample("relay_dropped_frames_total", "counter", "Frames dropped by the overflow policy", stats["dropped"])
+        sample("relay_overflow_disconnects_total", "counter", "Clients disconnected for being too slow",
+               stats["overflow_disconnects"])
+
+        if self._heartbeat is not None:
+            sample("relay_heartbeat_pings_total", "counter", "Heartbeat pings sent", self._heartbeat.pings)
+            sample("relay_idle_evictions_total", "counter", "Connections evicted after staying silent",
+                   self._heartbeat.evictions)
+
+        depths = Histogram(DEPTH_BUCKETS)
+        for depth in self._fanout.queue_depths():
+            depths.observe(depth)
+        depths.render("relay_queue_depth", "Outbound queue depth per connection, in frames", lines, labels)
+        self.fanout_latency.render("relay_fanout_latency_seconds", "Time to relay a received message to the clients",
+                                   lines, labels)
+        self.loop_lag.render("relay_event_loop_lag_seconds", "Event loop lag", lines, labels)
+        self.gc_pauses.render("relay_gc_pause_seconds", "Garbage collection pauses", lines, labels)
+        return "\n".join(lines) + "\n"
+
+    def process_request(self, connection, request):
+        """ websockets process_request hook: answers GET <path>, lets any other request upgrade """
+        if not self.path or urlparse(request.path).path != self.path:
+            return None
+        return connection.respond(http.HTTPStatus.OK, self.render())
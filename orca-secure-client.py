@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import asyncio
-import websockets
 import json
 import threading
 import pvorca
@@ -8,6 +7,11 @@ import pvspeaker
 import pvcheetah
 import pvrecorder
 from translate_agent import TranslateAgent
+import wire_protocol
+from wire_protocol import SPEECH, STATUS
+from relay_client import RelayClient
+from speech_output import SpeechOutput, SpeechThread, Playback
+from speech_pipeline import SpeechPipeline, StageWaits, pipeline_options_from_env
 from dotenv import load_dotenv
 import os
 import jwt
@@ -46,6 +50,8 @@ ip = os.getenv("WS_IP") # for dev mode
 access_key = os.getenv("PV_ACCESS_KEY")
 secret = os.getenv("SECRET_KEY")
 url = os.getenv("WS_URL") # for production once deployed at url
+presence = os.getenv("WS_PRESENCE", "0") == "1"  # Announce this client with a status message
+streaming = os.getenv("ORCA_STREAMING", "1") == "1"  # Play the first sentence while the next ones are synthesized
 
 # Set threading event to sequence recorder role
 recorder_control = threading.Event()
@@ -55,55 +61,41 @@ def generate_token(user_id):
     payload = {"user_id": user_id}
     return jwt.encode(payload, secret, algorithm="HS256")
 
-async def handle_messages(websocket, loop, recorder, speaker, agent, orca):
+async def handle_messages(websocket, client, pipeline):
     async for message in websocket:
-        try:
+        data = client.parse(message)
+        if data is None:
+            print("Received message is not a valid JSON.")
+            continue
 
-            data = json.loads(message)
-
-            if data.get("type") == "speech":
-                recorder_control.clear()
-                speaker.start()
-                text = data.get("text")
-                message_translated = agent.translate(text)
-                print("Message translated:", message_translated, " depuis ", text)
-                pcm, alignments = orca.synthesize(text=message_translated)
-                print("After synthesize")
-                speaker.flush(pcm)
-                print("Afer flush")
-                speaker.stop()
-                print("After stop")
-                recorder_control.set()
-                print("After control set")
+        if data.get("type") == "speech":
+            # Translated, synthesized and played by the pipeline, the loop goes on reading the connection
+            pipeline.submit(data.get("text"), data.get("translated"))
 
-        except json.JSONDecodeError:
-            print("Received message is not a valid JSON.")
-        except Exception as e:
-            print(f"Erreur dans handle_messages : {e}")
-            recorder_control.set()  # Réactiver l'enregistrement même en cas d'erreur
-            print("Recorder control set après erreur")
+def start_speaking(speaker):
+    """ Pause the recorder while the speaker plays a message """
+    recorder_control.clear()
+    speaker.start()
+
+def stop_speaking(speaker):
+    try:
+        speaker.stop()
+    finally:
+        recorder_control.set()  # Réactiver l'enregistrement, même en cas d'erreur
 
 async def send_status(websocket, status):
-    message = json.dumps({"type": "status", "status": status, "from": str(websocket.remote_address)})
+    message = wire_protocol.frame(websocket, STATUS, status, **{"from": str(websocket.remote_address)})
     await websocket.send(message)
 
 async def send_text(websocket, text):
-    message = json.dumps({
-        "type": "speech",
-        "text": text,
-        "from": str(websocket.remote_address)
-    })
+    message = wire_protocol.frame(websocket, SPEECH, text, **{"from": str(websocket.remote_address)})
     await websocket.send(message)
 
-async def send_inactive_delay(websocket):
-    await asyncio.sleep(0.1)
-    await send_status(websocket, "inactive")
+async def send_join(websocket, language, voice):
+    join_message = json.dumps({"type": "join", "language": language, "voice": voice})
+    await websocket.send(join_message)
 
-async def send_authentication(websocket, token):
-    auth_message = json.dumps({"type": "auth", "token": token})
-    await websocket.send(auth_message)
-
-def capture_audio_thread(websocket, loop, recorder, cheetah):
+def capture_audio_thread(client, recorder, cheetah):
     try:
         recorder.start()
         print('Listening... (press Ctrl+C to stop)')
@@ -118,9 +110,8 @@ def capture_audio_thread(websocket, loop, recorder, cheetah):
             if is_endpoint:
                 final_transcript = cheetah.flush()
                 print(transcript+final_transcript)
-                asyncio.run_coroutine_threadsafe(send_status(websocket, "active"), loop)
-                asyncio.run_coroutine_threadsafe(send_text(websocket, transcript + final_transcript), loop)
-                asyncio.run_coroutine_threadsafe(send_inactive_delay(websocket), loop)
+                # Queued while the connection is down, sent once reconnected
+                client.submit_threadsafe(send_text, transcript + final_transcript)
                 transcript = ""
                 recorder_control.set()
 
@@ -132,23 +123,33 @@ def capture_audio_thread(websocket, loop, recorder, cheetah):
         print("Transcription stopped.")
         recorder.stop()
 
-async def start_client(recorder, speaker, agent, orca, cheetah):
+async def start_client(recorder, agent, speech, waits, cheetah):
     websocket_url = "wss://" + url     # Dev mode: f"wss://{ip}:{port}"
     ssl_context = ssl.create_default_context()
     ssl_context.check_hostname = False
     ssl_context.verify_mode = ssl.CERT_NONE
 
-    async with websockets.connect(websocket_url, ssl=ssl_context) as websocket:
+    async def on_connect(websocket):
         print(f"WebSocket connection established at wss://{ip}:{port}.")
 
-        token = generate_token(user_id)
-        await send_authentication(websocket, token)
-
-        loop = asyncio.get_running_loop()
-        recorder_control.set()
-        thread = threading.Thread(target=capture_audio_thread, args=(websocket, loop, recorder, cheetah), daemon=True)
-        thread.start()
-        await handle_messages(websocket, loop, recorder, speaker, agent, orca)
+        # Join the room of the language this client listens in
+        await send_join(websocket, agent._language, agent._gender_speak)
+        if presence:
+            await send_status(websocket, "online")
+
+    # Reconnects after an outage with a new token, checked by the server before the upgrade
+    # The engines and the capture thread are kept across the connections
+    client = RelayClient(
+        websocket_url, on_connect=on_connect, headers=lambda: {"Authorization": f"Bearer {generate_token(user_id)}"},
+        ssl=ssl_context, subprotocols=wire_protocol.client_subprotocols(),
+    )
+    # Translation, synthesis and playback overlap, stale backlog is handled by SPEECH_STALE_POLICY
+    pipeline = SpeechPipeline(agent, speech, waits=waits, **pipeline_options_from_env())
+    pipeline.start()
+    recorder_control.set()
+    thread = threading.Thread(target=capture_audio_thread, args=(client, recorder, cheetah), daemon=True)
+    thread.start()
+    await client.run(lambda websocket: handle_messages(websocket, client, pipeline))
 
 def print_decorator(n):
     print("="*n)
@@ -206,21 +207,32 @@ def run():
         buffer_size_secs=20,
         device_index=device_speak)
     print(f"→ PV Speaker v{speaker.version} started.")
+    # Synthesis and playback on their own threads
+    waits = StageWaits()
+    playback = Playback(
+        speaker, orca.sample_rate, wait=waits.playback,
+        on_start=lambda: start_speaking(speaker), on_end=lambda: stop_speaking(speaker),
+    )
+    speech = SpeechThread(SpeechOutput(orca, playback, streaming=streaming), wait=waits.synthesis)
 
     print("PV Speaker selected : ", speaker.selected_device)
     print("PV Recoder selected : ", recorder.selected_device)
     print_decorator(50)
 
     try:
-        asyncio.run(start_client(recorder, speaker, agent, orca, cheetah))
+        asyncio.run(start_client(recorder, agent, speech, waits, cheetah))
     except KeyboardInterrupt:
         print("Client stopped by user.")
     finally:
         try:
+            speech.close()
+            print("Speech threads stopped.")
+            print(waits.report())
             speaker.stop()
             print("PV Speaker stopped.")
             speaker.delete()
             print("PV Speaker resources released.")
+            speech.speech.close()
             orca.delete()
             print("PV Orca resources released.")
             cheetah.delete()
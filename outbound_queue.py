@@ -0,0 +1,145 @@
+""" Bounded per-connection outbound queue with slow-consumer policies """
+import asyncio
+import collections
+import json
+import websockets
+import wire_protocol
+
+# Overflow policies, selected with the WS_OVERFLOW_POLICY env variable on the servers
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+POLICIES = (DROP_OLDEST, DROP_NEWEST, COALESCE, DISCONNECT)
+
+# Close code sent to a client disconnected for being too slow ("Try Again Later")
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def status_key(message, sender):
+    """ Return the coalescing key of a "status" message (one per sender), None for any other message """
+    if isinstance(message, wire_protocol.Message):
+        return id(sender) if message.type == wire_protocol.STATUS else None
+    if not isinstance(message, str) or '"status"' not in message:
+        return None
+    try:
+        data = json.loads(message)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(data, dict) and data.get("type") == "status":
+        return id(sender)
+    return None
+
+
+class OutboundQueue:
+    """
+    Frames waiting to be written to one slow client.
+    Depth and size are bounded by max_depth and max_bytes, a frame that does not fit is handled by the
+    overflow policy. Frames are stored already encoded so a message queued for many clients is encoded once.
+    """
+    def __init__(self, websocket, max_depth=64, max_bytes=1024 * 1024, policy=DROP_OLDEST):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self._websocket = websocket
+        self._frames = collections.deque()  # (payload, text, key)
+        self._wakeup = asyncio.Event()
+        self._busy = False
+        self._close_task = None
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.binary = False  # Client negotiated wire_protocol binary frames
+        self.bytes = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.overflow_disconnect = False
+
+    @property
+    def depth(self):
+        return len(self._frames)
+
+    def is_idle(self):
+        """ True when nothing is pending, so a frame can be written straight to the socket without reordering """
+        if self._frames or self._busy:
+            return False
+        transport = self._websocket.transport
+        return transport is None or transport.get_write_buffer_size() <= self._websocket.write_limit[0]
+
+    def put(self, payload, text=True, key=None):
+        """ Queue an encoded frame, returns False when the frame was dropped """
+        if self.overflow_disconnect:
+            self.dropped += 1
+            return False
+        size = len(payload)
+        if key is not None and self.policy == COALESCE and self._replace(key, payload, text):
+            return True
+        while self._frames and (len(self._frames) >= self.max_depth or self.bytes + size > self.max_bytes):
+            if not self._overflow():
+                self.dropped += 1
+                return False
+        if size > self.max_bytes:
+            # A single frame bigger than the whole budget can never be queued
+            self.dropped += 1
+            return False
+        self._frames.append((payload, text, key))
+        self.bytes += size
+        self._wakeup.set()
+        return True
+
+    def _replace(self, key, payload, text):
+        """ Replace a queued status frame of the same sender with the newer one """
+        for idx, (queued, _, queued_key) in enumerate(self._frames):
+            if queued_key == key:
+                self.bytes += len(payload) - len(queued)
+                self._frames[idx] = (payload, text, key)
+                self.coalesced += 1
+                return True
+        return False
+
+    def _overflow(self):
+        """ Make room according to the policy, returns False if the incoming frame must be dropped instead """
+        if self.policy == DROP_NEWEST:
+            return False
+        if self.policy == DISCONNECT:
+            self._disconnect()
+            return False
+        if self.policy == COALESCE:
+            # Presence frames are superseded state, evict them before any speech
+            for idx, (_, _, queued_key) in enumerate(self._frames):
+                if queued_key is not None:
+                    self._evict(idx)
+                    return True
+        self._evict(0)
+        return True
+
+    def _evict(self, idx):
+        payload = self._frames[idx][0]
+        del self._frames[idx]
+        self.bytes -= len(payload)
+        self.dropped += 1
+
+    def _disconnect(self):
+        self.overflow_disconnect = True
+        self.dropped += len(self._frames)
+        self._frames.clear()
+        self.bytes = 0
+        self._close_task = asyncio.create_task(
+            self._websocket.close(CLOSE_TRY_AGAIN_LATER, "Outbound queue overflow")
+        )
+
+    async def run(self):
+        """ Writer task: drains the queue in order, awaiting the socket so only this client waits on itself """
+        try:
+            while True:
+                while not self._frames:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                payload, text, _ = self._frames.popleft()
+                self.bytes -= len(payload)
+                self._busy = True
+                try:
+                    await self._websocket.send(payload, text=text)
+                finally:
+                    self._busy = False
+        except websockets.ConnectionClosed:
+            pass
@@ -0,0 +1,120 @@
+""" Token bucket rate limits of the incoming messages, per connection and per authenticated user """
+import os
+import time
+
+# Close code sent to a client disconnected for flooding ("Policy Violation")
+CLOSE_POLICY_VIOLATION = 1008
+
+
+class TokenBucket:
+    """
+    rate tokens per second up to burst. A take larger than the tokens left goes into debt,
+    the caller waits until the debt is repaid, so a message bigger than the burst is delayed but never refused.
+    """
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, amount, now):
+        """ Take amount tokens, returns the seconds to wait before reading the next message (0 when within the limit) """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class ClientLimit:
+    """ Buckets applying to one connection: its own ones and the ones shared by the connections of its user """
+    def __init__(self, limiter, buckets, user_id=None):
+        self._limiter = limiter
+        self._buckets = buckets  # [(bucket, counts bytes)]
+        self.user_id = user_id
+        self.throttled = 0
+        self.strikes = 0  # Consecutive throttled messages
+
+    def consume(self, size):
+        """ Account a received message of size bytes, returns the seconds to stop reading this connection """
+        now = time.monotonic()
+        delay = 0.0
+        for bucket, counts_bytes in self._buckets:
+            delay = max(delay, bucket.take(size if counts_bytes else 1, now))
+        if delay:
+            self.throttled += 1
+            self.strikes += 1
+        else:
+            self.strikes = 0
+        return delay
+
+    def offending(self):
+        """ True once the client stayed over its limit for disconnect_after messages in a row """
+        return 0 < self._limiter.disconnect_after <= self.strikes
+
+    def release(self):
+        self._limiter._release(self.user_id)
+
+
+class RateLimiter:
+    """
+    Limits on messages/sec and bytes/sec per connection, and per user_id for the connections of a same JWT user.
+    A rate of 0 disables the limit, the burst is burst seconds of the rate.
+    Over the limit the server stops reading the connection for the time given by the bucket: the frames pile up in
+    the websockets receive queue, then in the kernel buffers, and TCP flow control pushes back on the client.
+    With disconnect_after > 0, a client throttled on that many consecutive messages is disconnected.
+    """
+    def __init__(self, messages_per_sec=0, bytes_per_sec=0, user_messages_per_sec=0, user_bytes_per_sec=0,
+                 burst=2.0, disconnect_after=0):
+        self.messages_per_sec = messages_per_sec
+        self.bytes_per_sec = bytes_per_sec
+        self.user_messages_per_sec = user_messages_per_sec
+        self.user_bytes_per_sec = user_bytes_per_sec
+        self.burst = burst
+        self.disconnect_after = disconnect_after
+        self._users = {}  # user_id -> [buckets, connections]
+
+    def _buckets(self, messages_per_sec, bytes_per_sec):
+        buckets = []
+        if messages_per_sec:
+            buckets.append((TokenBucket(messages_per_sec, messages_per_sec * self.burst), False))
+        if bytes_per_sec:
+            buckets.append((TokenBucket(bytes_per_sec, bytes_per_sec * self.burst), True))
+        return buckets
+
+    def connect(self, user_id=None):
+        """ Limits of a new connection, user_id shares the user buckets with the other connections of the user """
+        buckets = self._buckets(self.messages_per_sec, self.bytes_per_sec)
+        if user_id is not None and (self.user_messages_per_sec or self.user_bytes_per_sec):
+            user = self._users.get(user_id)
+            if user is None:
+                user = self._users[user_id] = [self._buckets(self.user_messages_per_sec, self.user_bytes_per_sec), 0]
+            user[1] += 1
+            buckets += user[0]
+        else:
+            user_id = None
+        return ClientLimit(self, buckets, user_id)
+
+    def _release(self, user_id):
+        user = self._users.get(user_id)
+        if user is not None:
+            user[1] -= 1
+            if not user[1]:
+                del self._users[user_id]
+
+
+def rate_limiter_from_env():
+    """
+    Rate limits from env variables, all disabled by default:
+    WS_RATE_MESSAGES / WS_RATE_BYTES per connection, WS_USER_RATE_MESSAGES / WS_USER_RATE_BYTES per user_id,
+    WS_RATE_BURST (seconds of rate, default 2) and WS_RATE_DISCONNECT (consecutive throttled messages before closing)
+    """
+    return RateLimiter(
+        messages_per_sec=float(os.getenv("WS_RATE_MESSAGES", 0)),
+        bytes_per_sec=float(os.getenv("WS_RATE_BYTES", 0)),
+        user_messages_per_sec=float(os.getenv("WS_USER_RATE_MESSAGES", 0)),
+        user_bytes_per_sec=float(os.getenv("WS_USER_RATE_BYTES", 0)),
+        burst=float(os.getenv("WS_RATE_BURST", 2)),
+        disconnect_after=int(os.getenv("WS_RATE_DISCONNECT", 0)),
+    )
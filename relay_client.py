@@ -0,0 +1,104 @@
+""" Reconnecting client core: jittered exponential backoff, fresh credentials, buffered sends and resume """
+import asyncio
+import collections
+import json
+import random
+import uuid
+import websockets
+import wire_protocol
+from drain import reconnect_hint
+from session import CLIENT_ID_HEADER
+
+
+class RelayClient:
+    """
+    Keeps a client connected to the relay server across outages.
+    A lost connection is retried with exponential backoff and full jitter (min_delay doubling up to max_delay),
+    headers() is called again for every attempt so a new JWT is sent each time.
+    A server restarting closes with code 1012 and the delay to wait before reconnecting, which replaces the backoff.
+    Messages are submitted as a send function and its arguments, e.g. submit_threadsafe(send_text, text) from the
+    audio thread, and sent in order while connected. During an outage the last queue_size of them wait for the
+    next connection, the oldest are dropped first.
+    After every connection on_connect(websocket) runs (join the room...), then a "resume" message with the last
+    seq received asks the server for the speech messages missed meanwhile. Every connection sends the same client
+    id, the server never replays to the client its own messages.
+    Create it from the running loop.
+    """
+    def __init__(self, url, on_connect=None, headers=None, queue_size=64, min_delay=0.5, max_delay=30, **options):
+        self.url = url
+        self.on_connect = on_connect
+        self.headers = headers
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.options = options
+        self.websocket = None
+        self.client_id = uuid.uuid4().hex
+        self.last_seq = 0
+        self.dropped = 0
+        self._queue = collections.deque(maxlen=queue_size)  # (send, args)
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+
+    def submit(self, send, *args):
+        """ Queue await send(websocket, *args), sent as soon as connected """
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append((send, args))
+        self._wakeup.set()
+
+    def submit_threadsafe(self, send, *args):
+        self._loop.call_soon_threadsafe(self.submit, send, *args)
+
+    def parse(self, message):
+        """ wire_protocol.parse that remembers the seq of the last speech received, for the next resume """
+        data = wire_protocol.parse(message)
+        if isinstance(data, dict) and data.get("type") == "speech" and isinstance(data.get("seq"), int):
+            self.last_seq = data["seq"]
+        return data
+
+    async def run(self, handler):
+        """ Connect and await handler(websocket) until the connection ends, then reconnect, forever """
+        attempt = 0
+        while True:
+            websocket = None
+            try:
+                headers = {CLIENT_ID_HEADER: self.client_id, **(self.headers() if self.headers else {})}
+                async with websockets.connect(self.url, additional_headers=headers, **self.options) as websocket:
+                    attempt = 0
+                    self.websocket = websocket
+                    if self.on_connect:
+                        await self.on_connect(websocket)
+                    if self.last_seq:
+                        await websocket.send(json.dumps({"type": "resume", "seq": self.last_seq}))
+                    sender = asyncio.create_task(self._send_queued(websocket))
+                    try:
+                        await handler(websocket)
+                    finally:
+                        sender.cancel()
+                        self.websocket = None
+                print("Connection closed by the server.")
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                print(f"Connection lost: {e}")
+            delay = reconnect_hint(websocket)
+            if delay is None:
+                delay = random.uniform(0, min(self.max_delay, self.min_delay * 2 ** attempt))
+                attempt += 1
+            else:
+                print("Server restarting.")
+            print(f"Reconnecting in {delay:.1f} s, {len(self._queue)} messages waiting.")
+            await asyncio.sleep(delay)
+
+    async def _send_queued(self, websocket):
+        try:
+            while True:
+                while not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                item = self._queue[0]
+                send, args = item
+                await send(websocket, *args)
+                # Dequeued once sent only, a message failing on a closed connection is sent after the reconnection
+                if self._queue and self._queue[0] is item:
+                    self._queue.popleft()
+        except websockets.ConnectionClosed:
+            pass
@@ -0,0 +1,139 @@
+""" Relay shared by basic-ws-server.py, secure-ws-server.py and wss-jwt-server.py, which only add TLS and auth """
+import asyncio
+import time
+import websockets
+import logging
+import os
+from dotenv import load_dotenv
+from fanout import Fanout
+from language_rooms import LanguageRooms
+from translate_agent import TranslateAgent
+import workers
+import backplane
+import log_pipeline
+import wire_protocol
+from metrics import RelayMetrics
+from rate_limit import rate_limiter_from_env, CLOSE_POLICY_VIOLATION
+from heartbeat import heartbeat_from_env
+from session import server_options_from_env
+from drain import drain_from_env, listen_options
+
+# Get env variables
+load_dotenv()
+port = os.getenv("WS_PORT")
+ip = os.getenv("WS_IP")
+
+# Log to "server.log" in append mode from a background thread
+# LOG_MESSAGE_LEVEL (WARNING skips them) and LOG_MESSAGE_SAMPLE (0 to 1) select the message bodies written
+log_pipeline.setup(
+    filename="server.log",
+    message_level=os.getenv("LOG_MESSAGE_LEVEL", "INFO"),
+    message_sample=float(os.getenv("LOG_MESSAGE_SAMPLE", 1)),
+)
+log = logging.getLogger(log_pipeline.CONNECTIONS)
+message_log = logging.getLogger(log_pipeline.MESSAGES)
+
+# Connected clients, the sender of a message is excluded from its own broadcast
+# Slow clients get a bounded outbound queue: max frames, max bytes and overflow policy
+# (drop-oldest, drop-newest, coalesce or disconnect)
+fanout = Fanout(
+    queue_depth=int(os.getenv("WS_QUEUE_DEPTH", 64)),
+    queue_bytes=int(os.getenv("WS_QUEUE_BYTES", 1024 * 1024)),
+    policy=os.getenv("WS_OVERFLOW_POLICY", "drop-oldest"),
+)
+# Clients join the room of their language, set OLLAMA_MODEL to translate each speech once per room on the server
+# The last WS_HISTORY_SIZE speech messages of each room (WS_HISTORY_BYTES of text at most) are numbered and kept
+# for the clients resuming after a reconnection, 0 disables the history
+model = os.getenv("OLLAMA_MODEL")
+rooms = LanguageRooms(
+    fanout,
+    TranslateAgent(model=model) if model else None,
+    history_size=int(os.getenv("WS_HISTORY_SIZE", 256)),
+    history_bytes=int(os.getenv("WS_HISTORY_BYTES", 256 * 1024)),
+)
+# Pings every WS_HEARTBEAT_INTERVAL seconds from one timer wheel, connections silent for WS_IDLE_TIMEOUT are evicted
+heartbeat = heartbeat_from_env()
+# Counters, latency histograms and queue depths served at METRICS_PATH on the websocket port (empty disables it)
+metrics = RelayMetrics(fanout, path=os.getenv("METRICS_PATH", "/metrics"), heartbeat=heartbeat)
+# Token bucket limits of the incoming messages (WS_RATE_* env variables, disabled by default), see rate_limit.py
+limiter = rate_limiter_from_env()
+# Per-connection buffers and compression (WS_MAX_SIZE, WS_MAX_QUEUE, WS_WRITE_LIMIT, WS_COMPRESSION...), see session.py
+connection_options = server_options_from_env()
+# SIGTERM closes the connections with code 1012 over WS_DRAIN_PERIOD seconds, SIGUSR2 hands the listening socket
+# over to a new process first, see drain.py
+drain = drain_from_env()
+
+
+async def relay(session):
+    """ Relays the messages of a connected (and authenticated) client until it disconnects """
+    websocket = session.websocket
+    metrics.connected()
+    heartbeat.add(session)
+    fanout.add(websocket)
+    rooms.add(session)
+    # Limits of this connection, and of all the connections of the same user
+    session.limit = limiter.connect(session.user_id)
+    try:
+        async for message in websocket:
+            delay = session.limit.consume(len(message))
+            if delay:
+                metrics.throttled += 1
+                if session.limit.offending():
+                    log.info("Rate limit exceeded by %s, disconnecting", session.address)
+                    metrics.rate_limit_disconnects += 1
+                    await websocket.close(CLOSE_POLICY_VIOLATION, "Rate limit exceeded")
+                    break
+                # Over the limit: stop reading this client, its frames wait in the socket buffers meanwhile
+                await asyncio.sleep(delay)
+            received = time.perf_counter()
+            metrics.messages_in += 1
+            metrics.bytes_in += len(message)
+            session.messages_in += 1
+            session.last_seen = time.monotonic()
+            session.bytes_in += len(message)
+            # Log the received message in the log file, formatted by the log writer thread
+            message_log.info("Message received from %s: %s", session.address, message)
+
+            # Relay the message to all other clients, translated for their room, without waiting for them to drain
+            rooms.route(websocket, message)
+            metrics.fanout_latency.observe(time.perf_counter() - received)
+    except websockets.ConnectionClosed:
+        log.info("Connection closed: %s", session.address)
+    finally:
+        # Cleanup when the client disconnects
+        queue = fanout.queue(websocket)
+        if queue is not None and queue.dropped:
+            log.info("Frames dropped for slow client %s: %d", session.address, queue.dropped)
+        rooms.discard(websocket)
+        fanout.discard(websocket)
+        session.limit.release()
+        heartbeat.discard(session)
+        metrics.disconnected()
+        log.info("Client disconnected: %s (%d messages, %d bytes received)",
+                 session.address, session.messages_in, session.bytes_in)
+
+
+async def serve(handler, ssl=None, process_request=None, select_subprotocol=None):
+    """ Serves handler on WS_IP:WS_PORT until SIGTERM, SIGINT or SIGUSR2 and the drain are over """
+    # Backplane to the other workers (WS_WORKERS > 1) or server nodes (WS_BACKPLANE=tcp://broker:port),
+    # speech is translated by the one receiving it, see LanguageRooms.deliver
+    bus = rooms.bus = await backplane.connect(os.getenv("WS_BACKPLANE"), rooms.deliver)
+    metrics.start()
+    heartbeat.start()
+    drain.install(handover=not workers.is_worker())
+
+    async with websockets.serve(
+        handler, **listen_options(ip, port, workers.reuse_port()), ssl=ssl, **connection_options,
+        ping_interval=None,  # Heartbeats come from the timer wheel, not from a task per connection
+        process_request=process_request or metrics.process_request,
+        select_subprotocol=select_subprotocol or wire_protocol.select_subprotocol,
+    ) as server:
+        print(f"Server started at {'wss' if ssl else 'ws'}://{ip}:{port}")
+        await drain.run(server)
+    if bus is not None:
+        await bus.close()
+
+
+def run(main):
+    """ Runs main in WS_WORKERS processes sharing the port, see workers.py """
+    workers.run(main, int(os.getenv("WS_WORKERS", 1)))
@@ -3,22 +3,25 @@
 
 import asyncio
 import websockets
-import json
 import threading
 import ssl
+import os
+import wire_protocol
+from wire_protocol import SPEECH, STATUS
 
 ssl_context = ssl.create_default_context()
 ssl_context.check_hostname = False
 ssl_context.verify_mode = ssl.CERT_NONE
 
+presence = os.getenv("WS_PRESENCE", "0") == "1"  # Announce this client with a status message
+
 async def handle_messages(websocket):
     """
     Continuously listens to messages received from the server and displays them immediately.
     """
     async for message in websocket:
-        try:
-            data = json.loads(message)
-        except json.JSONDecodeError:
+        data = wire_protocol.parse(message)
+        if data is None:
             print("Received message is not a valid JSON.")
             continue
 
@@ -30,9 +33,10 @@ async def handle_messages(websocket):
 
 async def send_status(websocket, status):
     """
-    Sends a "status" type message to indicate the client's status.
+    Sends a "status" type message to announce the client's presence, only with WS_PRESENCE=1.
+    Utterances do not need it, the server never relays a message back to its sender.
     """
-    message = json.dumps({"type": "status", "status": status})
+    message = wire_protocol.frame(websocket, STATUS, status)
     await websocket.send(message)
 
 
@@ -40,24 +44,12 @@ async def send_text(websocket, text):
     """
     Sends a "speech" type message containing the entered text.
     """
-    message = json.dumps({
-        "type": "speech",
-        "text": text,
-        "from": str(websocket.remote_address)
-    })
+    message = wire_protocol.frame(websocket, SPEECH, text, **{"from": str(websocket.remote_address)})
     print("Message sent")
     print(message)
     await websocket.send(message)
 
 
-async def send_inactive_delay(websocket):
-    """
-    Waits for a short delay and then sets the client's status to "inactive".
-    """
-    await asyncio.sleep(0.1)
-    await send_status(websocket, "inactive")
-
-
 def input_thread(websocket, loop):
     """
     Function executed in a separate thread for user input.
@@ -73,9 +65,7 @@ def input_thread(websocket, loop):
             continue  # Ignore empty inputs
 
         # Schedule the sending of messages in the asynchronous loop via run_coroutine_threadsafe
-        asyncio.run_coroutine_threadsafe(send_status(websocket, "active"), loop)
         asyncio.run_coroutine_threadsafe(send_text(websocket, text), loop)
-        asyncio.run_coroutine_threadsafe(send_inactive_delay(websocket), loop)
 
 
 async def start_client():
@@ -84,8 +74,10 @@ async def start_client():
     and user input via a thread.
     """
     websocket_url = "wss://172.20.10.2:8765"  # Verify that the URL and port are correct
-    async with websockets.connect(websocket_url, ssl=ssl_context) as websocket:
+    async with websockets.connect(websocket_url, ssl=ssl_context, subprotocols=wire_protocol.client_subprotocols()) as websocket:
         print("WebSocket connection established.")
+        if presence:
+            await send_status(websocket, "online")
         # Get the current asynchronous loop
         loop = asyncio.get_running_loop()
         # Start the thread for user input
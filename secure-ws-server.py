@@ -1,74 +1,25 @@
 #!/usr/bin/env python3
 ## Websocket server SSL only to secure connection
-import asyncio
-import websockets
-import logging
-import os
-import ssl
-from dotenv import load_dotenv
+import relay_server
+from relay_server import log
+from session import Session
+import tls_profile
 
-
-# Configure logging to write in "server.log" in append mode
-logging.basicConfig(
-    level=logging.INFO,
-    filename="server.log",
-    filemode="a",
-    format="%(asctime)s %(message)s"
-)
-
-# Create SSL context, .crt and .key files are needed
+# Create SSL context, .crt and .key files are needed (TLS_CERT_FILE and TLS_KEY_FILE, ./cert/localhost.* by default)
 # Self-signed certificates generated in development mode, use a signing authority in production like Let's Encrypt
-ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-ssl_context.load_cert_chain(certfile='./cert/localhost.crt', keyfile='./cert/localhost.key')
-
-# Get env variables
-load_dotenv()
-port = os.getenv("WS_PORT")
-ip = os.getenv("WS_IP")
-
-# Global dictionary of clients: websocket -> status ("active" or "inactive")
-clients = {}
+# Session resumption, TLS 1.3 only mode, ECDSA certificate and curves are set by the TLS_* env variables, see tls_profile.py
+ssl_context = tls_profile.server_context_from_env()
 
 
 async def handler(websocket):
-    logging.info(f"Client connected: {websocket.remote_address}")
-    print(f"Client connected: {websocket.remote_address}")
-    # Add the client with a default "inactive" status
-    clients[websocket] = "inactive"
-    try:
-        async for message in websocket:
-            # Log the received message in the log file
-            logging.info(f"Message received from {websocket.remote_address}: {message}")
-
-            # Mark the sender as "active"
-            clients[websocket] = "active"
-
-            # Broadcast the message to all clients with the "inactive" status
-            broadcast_clients = [
-                ws for ws, status in clients.items() if status == "inactive"
-            ]
-            if broadcast_clients:
-                await asyncio.gather(*[ws.send(message) for ws in broadcast_clients])
-
-            # Set the sender's status back to "inactive"
-            clients[websocket] = "inactive"
-    except websockets.ConnectionClosed:
-        logging.info(f"Connection closed: {websocket.remote_address}")
-        print(f"Connection closed: {websocket.remote_address}")
-    finally:
-        # Cleanup when the client disconnects
-        del clients[websocket]
-        logging.info(f"Client disconnected: {websocket.remote_address}")
-        print(f"Client disconnected: {websocket.remote_address}")
+    session = Session(websocket)
+    log.info("Client connected: %s", session.address)
+    await relay_server.relay(session)
 
 
 async def main():
-
-
-    async with websockets.serve(handler, ip, port, ssl=ssl_context):
-        print(f"Server started at wss://{ip}:{port}")
-        await asyncio.Future()  # Keeps the server running indefinitely
+    await relay_server.serve(handler, ssl=ssl_context)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    relay_server.run(main)
@@ -0,0 +1,53 @@
+""" Cuts texts into the sentences or phrases translated and synthesized one at a time """
+import re
+
+# End of a sentence: punctuation, closing quotes or brackets, then a space
+SENTENCE_END = re.compile(r"[.!?…]+[\"'»)\]]*\s+")
+# End of a phrase: a shorter cut, taken once the segment is long enough
+PHRASE_END = re.compile(r"[,;:]\s+")
+
+
+class Segmenter:
+    """
+    Cuts a stream of text deltas into segments to synthesize: sentences, or phrases of min_phrase characters at
+    least ending with a comma, semicolon or colon. A segment never exceeds max_chars, a longer run without
+    punctuation is cut at the last space.
+    """
+    def __init__(self, min_phrase=40, max_chars=200):
+        self.min_phrase = min_phrase
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, delta):
+        """ Add a delta, returns the segments it completed """
+        self._buffer += delta
+        segments = []
+        while (cut := self._cut()) is not None:
+            segment, self._buffer = self._buffer[:cut].strip(), self._buffer[cut:]
+            if segment:
+                segments.append(segment)
+        return segments
+
+    def flush(self):
+        """ The rest of the text, once the stream is over """
+        segment, self._buffer = self._buffer.strip(), ""
+        return segment
+
+    def _cut(self):
+        match = SENTENCE_END.search(self._buffer)
+        if match is not None and match.end() <= self.max_chars:
+            return match.end()
+        match = PHRASE_END.search(self._buffer, self.min_phrase)
+        if match is not None and match.end() <= self.max_chars:
+            return match.end()
+        if len(self._buffer) > self.max_chars:
+            space = self._buffer.rfind(" ", 0, self.max_chars)
+            return space + 1 if space > 0 else self.max_chars
+        return None
+
+
+def split_segments(source):
+    """ Complete sentences or long phrases of a transcript, and its unfinished end """
+    segmenter = Segmenter()
+    segments = segmenter.feed(source)
+    return segments, segmenter.flush()
@@ -0,0 +1,69 @@
+""" Per-connection session record and the per-connection buffer and compression limits of the servers """
+import os
+import time
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+
+# Header carrying the id a client keeps across its reconnections (see relay_client.py)
+CLIENT_ID_HEADER = "X-Relay-Client"
+
+
+class Session:
+    """
+    State of one client connection: identity, room, counters and resume point.
+    __slots__ keep the record itself around a hundred bytes (no __dict__), most connections are idle listeners.
+    The remote address is captured at connection time, websockets no longer knows it once the socket is closed.
+    """
+    __slots__ = ("websocket", "address", "user_id", "client_id", "language", "voice", "connected_at",
+                 "messages_in", "bytes_in", "resumed_seq", "limit", "last_seen", "pong", "wheel_slot")
+
+    def __init__(self, websocket, user_id=None):
+        self.websocket = websocket
+        self.address = websocket.remote_address
+        self.user_id = user_id
+        request = websocket.request
+        self.client_id = request.headers.get(CLIENT_ID_HEADER) if request is not None else None
+        self.language = None
+        self.voice = None
+        self.connected_at = time.monotonic()
+        self.messages_in = 0
+        self.bytes_in = 0
+        self.resumed_seq = None  # Last seq the client had received when it resumed
+        self.limit = None  # rate_limit.ClientLimit
+        # heartbeat.Heartbeat state: last message or pong, pending ping and slot in the wheel
+        self.last_seen = self.connected_at
+        self.pong = None
+        self.wheel_slot = None
+
+    @property
+    def sender(self):
+        """ Identity of the client across its reconnections: its client id, else its JWT user, else None """
+        return self.client_id or self.user_id
+
+    def __repr__(self):
+        return f"Session({self.address}, user={self.user_id}, room={self.language})"
+
+
+def server_options_from_env():
+    """
+    websockets.serve options bounding the memory of each connection, from env variables:
+    WS_MAX_SIZE (largest incoming message, default 1 MiB), WS_MAX_QUEUE (incoming frames buffered, default 16),
+    WS_WRITE_LIMIT (write buffer high-water mark, default 32 KiB), WS_COMPRESSION (none or deflate, default none)
+    with WS_DEFLATE_WINDOW_BITS (9 to 15, default 12) and WS_DEFLATE_MEM_LEVEL (1 to 9, default 5).
+    Compression is off by default: the messages are short texts that barely compress, and the deflate contexts
+    kept by every connection negotiating it roughly triple the memory of an idle connection
+    (see benchmark-idle-connections.py).
+    """
+    options = {
+        "max_size": int(os.getenv("WS_MAX_SIZE", 1024 * 1024)),
+        "max_queue": int(os.getenv("WS_MAX_QUEUE", 16)),
+        "write_limit": int(os.getenv("WS_WRITE_LIMIT", 32 * 1024)),
+        "compression": None,
+    }
+    if os.getenv("WS_COMPRESSION", "none") == "deflate":
+        window_bits = int(os.getenv("WS_DEFLATE_WINDOW_BITS", 12))
+        options["extensions"] = [ServerPerMessageDeflateFactory(
+            server_max_window_bits=window_bits,
+            client_max_window_bits=window_bits,
+            compress_settings={"memLevel": int(os.getenv("WS_DEFLATE_MEM_LEVEL", 5))},
+        )]
+    return options
@@ -1,2 +1,181 @@
 """ WebSocket client that sends chunks live to the WebSocket server instead of waiting for the user to stop talking """
+import asyncio
+import collections
+import json
+import os
+import threading
+import pvcheetah
+import pvorca
+import pvrecorder
+import pvspeaker
+from dotenv import load_dotenv
+from translate_agent import TranslateAgent
+from live_transcript import Utterances, TranscriptAssembler
+from relay_client import RelayClient
+from speech_output import SpeechOutput, SpeechThread, Playback
+from speech_pipeline import SpeechPipeline, StageWaits, pipeline_options_from_env
+from orca_client import (recon_model_mapping, speak_model_mapping, print_decorator, select_device_audio_capture,
+                         select_device_audio_speak, recorder_control, start_speaking, stop_speaking)
 
+load_dotenv()
+access_key = os.getenv("PV_ACCESS_KEY")
+url = os.getenv("WS_URL")
+streaming = os.getenv("ORCA_STREAMING", "1") == "1"  # Play the first sentence while the next ones are synthesized
+# Translate the utterances of the others while they are spoken, stops once the server translates for this room
+speculate = os.getenv("TRANSLATE_SPECULATIVE", "1") == "1"
+
+# Utterances of this client, streamed as chunks then committed
+utterances = Utterances()
+
+
+async def handle_messages(websocket, client, assembler, pipeline, agent):
+    global speculate
+    sessions = collections.OrderedDict()  # utterance -> translate_agent.TranslationSession
+    async for message in websocket:
+        data = client.parse(message)
+        if data is None:
+            print("Received message is not a valid JSON.")
+            continue
+
+        if data.get("type") == "chunk":
+            # The other speaker is still talking, show the words recognized so far
+            text = assembler.add(data)
+            if text is not None:
+                print(f"\r… {text}", end="", flush=True)
+                if speculate:
+                    if data["utterance"] not in sessions:
+                        sessions[data["utterance"]] = agent.session()
+                        while len(sessions) > assembler.max_open:
+                            sessions.popitem(last=False)
+                    sessions[data["utterance"]].update(text)
+        elif data.get("type") == "speech":
+            session = sessions.pop(data.get("utterance"), None)
+            if data.get("utterance") is not None:
+                assembler.commit(data)
+                print("\r", end="")
+            if data.get("translated"):
+                speculate = False
+                session = None
+            print(f"» {data.get('text')}")
+            pipeline.submit(data.get("text"), data.get("translated"), session)
+
+
+async def send_message(websocket, message):
+    await websocket.send(message)
+
+
+async def send_join(websocket, language, voice):
+    join_message = json.dumps({"type": "join", "language": language, "voice": voice})
+    await websocket.send(join_message)
+
+
+def capture_audio_thread(client, recorder, cheetah):
+    """
+    Every partial transcript is sent as a chunk right away, the whole utterance is committed at the endpoint.
+    Capture pauses while the speaker plays, the speech of the others is never streamed back.
+    """
+    try:
+        recorder.start()
+        print('Listening... (press Ctrl+C to stop)')
+
+        transcript = ""
+        while True:
+            recorder_control.wait()
+            partial_transcript, is_endpoint = cheetah.process(recorder.read())
+            if partial_transcript:
+                transcript += partial_transcript
+                client.submit_threadsafe(send_message, utterances.chunk(partial_transcript))
+            if is_endpoint:
+                final_transcript = cheetah.flush()
+                if final_transcript:
+                    transcript += final_transcript
+                    client.submit_threadsafe(send_message, utterances.chunk(final_transcript))
+                if transcript.strip():
+                    print(transcript)
+                    # Queued while the connection is down, sent once reconnected
+                    client.submit_threadsafe(send_message, utterances.commit(transcript))
+                transcript = ""
+
+    except Exception as error:
+        print("Error while capturing audio : ", error)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Transcription stopped.")
+        recorder.stop()
+
+
+async def start_client(recorder, agent, speech, waits, cheetah):
+    websocket_url = "wss://" + url
+
+    async def on_connect(websocket):
+        print(f"WebSocket connection established at {websocket_url}")
+        # Join the room of the language this client listens in
+        await send_join(websocket, agent._language, agent._gender_speak)
+
+    # JSON messages only, chunks and utterance ids have no binary frame
+    client = RelayClient(websocket_url, on_connect=on_connect)
+    assembler = TranscriptAssembler()
+    pipeline = SpeechPipeline(agent, speech, waits=waits, **pipeline_options_from_env())
+    pipeline.start()
+    thread = threading.Thread(target=capture_audio_thread, args=(client, recorder, cheetah), daemon=True)
+    thread.start()
+    await client.run(lambda websocket: handle_messages(websocket, client, assembler, pipeline, agent))
+
+
+def run():
+    agent = TranslateAgent()
+    agent.choose_model()
+    agent.select_language()
+    agent.select_gender_speak()
+
+    device_listen = select_device_audio_capture()
+    recorder = pvrecorder.PvRecorder(frame_length=512, device_index=device_listen, buffered_frames_count=50)
+    device_speak = select_device_audio_speak()
+    print(f"→ PV Recorder v{recorder.version} started.")
+
+    cheetah = pvcheetah.create(access_key=access_key, model_path=recon_model_mapping[agent._language], endpoint_duration_sec=2, enable_automatic_punctuation=True)
+    print(f"→ PV Cheetah v{cheetah.version} started with language {agent._language}.")
+
+    orca_model = f"{agent._gender_speak} {agent._language}"
+    orca = pvorca.create(access_key=access_key, model_path=speak_model_mapping[orca_model])
+    print(f"→ PV Orca v{orca.version} started with {orca_model} voice.")
+
+    speaker = pvspeaker.PvSpeaker(
+        sample_rate=22050,
+        bits_per_sample=16,
+        buffer_size_secs=20,
+        device_index=device_speak)
+    print(f"→ PV Speaker v{speaker.version} started.")
+    # The committed utterances of the others are spoken, the chunks are only displayed
+    waits = StageWaits()
+    playback = Playback(
+        speaker, orca.sample_rate, wait=waits.playback,
+        on_start=lambda: start_speaking(speaker), on_end=lambda: stop_speaking(speaker),
+    )
+    speech = SpeechThread(SpeechOutput(orca, playback, streaming=streaming), wait=waits.synthesis)
+    print_decorator(50)
+
+    try:
+        asyncio.run(start_client(recorder, agent, speech, waits, cheetah))
+    except KeyboardInterrupt:
+        print("Client stopped by user.")
+    finally:
+        try:
+            speech.close()
+            print("Speech threads stopped.")
+            print(waits.report())
+            speaker.stop()
+            speaker.delete()
+            speech.speech.close()
+            orca.delete()
+            cheetah.delete()
+            recorder.stop()
+            recorder.delete()
+            print("PV resources released.")
+        except Exception as e:
+            print(f"Error while shutting down : {e}")
+
+
+if __name__ == "__main__":
+    run()
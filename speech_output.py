@@ -0,0 +1,199 @@
+""" Speech output of the Orca clients: synthesis and playback stages, each on its own thread """
+import concurrent.futures
+import queue
+import re
+import threading
+import time
+
+# Words with their trailing spaces, the chunks fed to the Orca stream as an LLM would produce them
+WORD_PATTERN = re.compile(r"\S+\s*")
+# Steps queued to the SpeechThread and the Playback, with the time they were queued
+BEGIN, FEED, FINISH = range(3)
+
+
+class SpeechOutput:
+    """
+    Synthesizes texts with Orca into a Playback.
+    Without streaming each segment is synthesized whole. With streaming the text is fed word by word to an
+    Orca stream, which returns PCM as soon as it has enough text (about a sentence), so the first sentence plays
+    while the next ones are synthesized.
+    """
+    def __init__(self, orca, playback, streaming=True):
+        self._orca = orca
+        self.playback = playback
+        self._stream = orca.stream_open() if streaming else None
+
+    def feed(self, text):
+        """ Synthesize the next segment of the text and queue its audio """
+        if self._stream is None:
+            pcm, alignments = self._orca.synthesize(text=text)
+            self.playback.write(pcm)
+            return
+        for word in WORD_PATTERN.findall(text):
+            self.playback.write(self._stream.synthesize(word))
+
+    def flush(self):
+        """ Synthesize the end of the text kept by the Orca stream """
+        if self._stream is not None:
+            self.playback.write(self._stream.flush())
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+
+class Playback:
+    """
+    Playback stage: a thread writing the PCM of the texts to PvSpeaker in order.
+    The queue holds at most depth PCM chunks, write() blocks the synthesis thread when it is full.
+    The time to first audio and the duration of each text are measured here, when its audio reaches the speaker.
+    on_start() and on_end() run on the thread around each text (start the speaker, pause the recorder...),
+    on_end() also after a failed synthesis. An error of the speaker or of the hooks skips the rest of the text and
+    is set on its future, the thread goes on with the next text. wait.observe(seconds) gets the time every chunk
+    waited in the queue.
+    """
+    def __init__(self, speaker, sample_rate, depth=64, on_start=None, on_end=None, wait=None):
+        self._speaker = speaker
+        self.sample_rate = sample_rate
+        self._on_start = on_start
+        self._on_end = on_end
+        self._wait = wait
+        self._steps = queue.Queue(maxsize=depth)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="playback", daemon=True)
+        self._thread.start()
+
+    def begin(self, started):
+        self._put(BEGIN, started)
+
+    def write(self, pcm):
+        if pcm:
+            self._put(FEED, pcm)
+
+    def finish(self, done, error=None):
+        """ Resolve the concurrent.futures.Future done with (time to first audio, seconds of audio) once played """
+        self._put(FINISH, (done, error))
+
+    def _put(self, kind, arg):
+        if not self._closed:
+            self._steps.put((kind, arg, time.perf_counter()))
+
+    def close(self):
+        """ Stop the thread once the chunk being played is over, the queued ones are dropped """
+        self._closed = True
+        _clear(self._steps)
+        self._steps.put(None)
+        self._thread.join()
+
+    def _run(self):
+        started = first_audio = failed = None
+        samples = 0
+        while (step := self._steps.get()) is not None:
+            kind, arg, queued = step
+            if self._wait is not None:
+                self._wait.observe(time.perf_counter() - queued)
+            if kind == FINISH:
+                done, error = arg
+                error = error or failed
+                try:
+                    if error is None:
+                        # Blocks until the buffered audio is played
+                        self._speaker.flush()
+                except Exception as e:
+                    error = e
+                try:
+                    if self._on_end:
+                        self._on_end()
+                except Exception as e:
+                    error = error or e
+                if error is not None:
+                    done.set_exception(error)
+                else:
+                    done.set_result((first_audio or 0, samples / self.sample_rate))
+                continue
+            try:
+                if kind == BEGIN:
+                    started, first_audio, samples, failed = arg, None, 0, None
+                    if self._on_start:
+                        self._on_start()
+                elif failed is not None:
+                    pass  # Rest of a text that failed
+                else:
+                    if first_audio is None:
+                        first_audio = time.perf_counter() - started
+                    samples += self._write(arg)
+            except Exception as e:
+                failed = e
+
+    def _write(self, pcm):
+        """ Queue the PCM in the speaker buffer, waiting for room when it is full """
+        written = 0
+        while written < len(pcm):
+            count = self._speaker.write(pcm[written:])
+            if count == 0:
+                time.sleep(0.02)
+            written += count
+        return written
+
+
+class SpeechThread:
+    """
+    Synthesis stage: runs a SpeechOutput on a dedicated thread, synthesis and playback never block the event loop.
+    The steps of a text are queued: begin(), feed() for each segment, then finish() returns a
+    concurrent.futures.Future of (time to first audio, seconds of audio) resolved once the text is played.
+    The next text is synthesized while the Playback plays this one. wait.observe(seconds) gets the time every
+    step waited in the queue.
+    """
+    def __init__(self, speech, wait=None):
+        self.speech = speech
+        self._wait = wait
+        self._steps = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="speech", daemon=True)
+        self._thread.start()
+
+    def begin(self, started=None):
+        self._steps.put((BEGIN, started if started is not None else time.perf_counter(), time.perf_counter()))
+
+    def feed(self, text):
+        self._steps.put((FEED, text, time.perf_counter()))
+
+    def finish(self):
+        done = concurrent.futures.Future()
+        self._steps.put((FINISH, done, time.perf_counter()))
+        return done
+
+    def close(self):
+        """ Stop the synthesis and playback threads once the text being played is over, the queued ones are dropped """
+        _clear(self._steps)
+        self._steps.put(None)
+        self.speech.playback.close()
+        self._thread.join()
+
+    def _run(self):
+        playback = self.speech.playback
+        error = None
+        while (step := self._steps.get()) is not None:
+            kind, arg, queued = step
+            if self._wait is not None:
+                self._wait.observe(time.perf_counter() - queued)
+            try:
+                if kind == BEGIN:
+                    error = None
+                    playback.begin(arg)
+                elif error is not None:
+                    pass  # Rest of a text that failed
+                elif kind == FEED:
+                    self.speech.feed(arg)
+                else:
+                    self.speech.flush()
+            except Exception as e:
+                error = e
+            if kind == FINISH:
+                playback.finish(arg, error)
+
+
+def _clear(steps):
+    with steps.mutex:
+        steps.queue.clear()
+        steps.not_full.notify_all()
@@ -0,0 +1,174 @@
+""" Receive side of the Orca clients: translation streamed into speech, cut into sentences or phrases spoken while the LLM generates """
+import asyncio
+import collections
+import os
+import time
+from metrics import Histogram
+from segmenter import Segmenter
+
+# Upper bounds in seconds of the queue wait buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# What happens to the messages waiting too long: all spoken, dropped, or merged into one summary
+STALE_POLICIES = ("keep", "drop", "summarize")
+
+
+async def queue_translation(agent, speech, text, language=None, segmenter=None, started=None, summarize=False):
+    """
+    Translate text with agent.translate_stream and queue it to speech (speech_output.SpeechThread).
+    Every segment completed by the LLM is synthesized and played while the next ones are generated,
+    so decoding, synthesis and playback overlap instead of adding up.
+    Returns the translated text once generated and a future of (time to first audio since started, seconds of
+    audio), done once played.
+    """
+    segmenter = segmenter or Segmenter()
+    speech.begin(started)
+    translated = []
+    try:
+        async for delta in agent.translate_stream(text, language, summarize=summarize):
+            translated.append(delta)
+            for segment in segmenter.feed(delta):
+                speech.feed(segment)
+        rest = segmenter.flush()
+        if rest:
+            speech.feed(rest)
+    finally:
+        # The speech thread ends with what was translated, an error of the LLM included
+        played = asyncio.wrap_future(speech.finish())
+    return "".join(translated), played
+
+
+def queue_text(speech, text, started=None):
+    """ Queue an already translated text to speech, returns the future of (time to first audio, seconds of audio) """
+    speech.begin(started)
+    speech.feed(text)
+    return asyncio.wrap_future(speech.finish())
+
+
+class StageWaits:
+    """ Time spent waiting in the queue of each stage: backlog before translation, synthesis and playback """
+    def __init__(self):
+        self.translation = Histogram(WAIT_BUCKETS)
+        self.synthesis = Histogram(WAIT_BUCKETS)
+        self.playback = Histogram(WAIT_BUCKETS)
+
+    def report(self):
+        lines = []
+        for stage in ("translation", "synthesis", "playback"):
+            waits = getattr(self, stage)
+            if waits.count:
+                lines.append(f"{stage} queue wait: mean {waits.sum / waits.count:.3f} s, "
+                             f"p95 <= {waits.quantile(0.95)} s over {waits.count}")
+        return "\n".join(lines)
+
+
+class SpeechPipeline:
+    """
+    Receive side of the Orca clients, off the event loop so it keeps reading frames, answering pings and sending
+    the utterances captured meanwhile. The websocket handler only submits the speech messages.
+    Three stages overlap, each with its own queue and worker: a task translates the messages in order (streamed
+    into the synthesis queue with stream_translation, else in an executor thread), a speech_output.SpeechThread
+    synthesizes them and a speech_output.Playback plays them, in order. While a message plays, the next ahead
+    ones are translated and synthesized; the backlog waits before translation.
+    Backlog past max_backlog messages or older than stale_after seconds (0: no age limit) is stale: stale_policy
+    "keep" speaks everything (and max_backlog is ignored), "drop" skips it, "summarize" speaks one summary of it.
+    The most recent message is never stale.
+    """
+    def __init__(self, agent, speech, stream_translation=True, ahead=1, max_backlog=8, stale_after=0,
+                 stale_policy="keep", waits=None):
+        if stale_policy not in STALE_POLICIES:
+            raise ValueError(f"Unknown stale policy: {stale_policy}")
+        self._agent = agent
+        self._speech = speech
+        self.stream_translation = stream_translation
+        self.max_backlog = max_backlog
+        self.stale_after = stale_after
+        self.stale_policy = stale_policy
+        self.waits = waits or StageWaits()
+        self.dropped = 0
+        self.summarized = 0
+        self._backlog = collections.deque()  # (text, translated, received, summarize, session)
+        self._ready = asyncio.Event()
+        self._slots = asyncio.Semaphore(ahead + 1)  # Messages between translation and the end of their playback
+        self._task = None
+
+    def start(self):
+        """ Start the translation task, call it from the running loop """
+        self._task = asyncio.create_task(self._run())
+
+    def submit(self, text, translated=False, session=None):
+        """
+        Queue a received speech message, translated when the server already translated it.
+        session is the translate_agent.TranslationSession that translated the utterance while it was spoken.
+        """
+        self._backlog.append((text, translated, time.perf_counter(), False, session))
+        self._ready.set()
+
+    async def _next(self):
+        while not self._backlog:
+            self._ready.clear()
+            await self._ready.wait()
+        stale = []
+        if self.stale_policy != "keep":
+            now = time.perf_counter()
+            while len(self._backlog) > 1 and (
+                len(self._backlog) > self.max_backlog
+                or (self.stale_after and now - self._backlog[0][2] > self.stale_after)
+            ):
+                stale.append(self._backlog.popleft())
+        if stale and self.stale_policy == "drop":
+            self.dropped += len(stale)
+            print(f"Skipped {len(stale)} stale messages.")
+        elif stale:
+            self.summarized += len(stale)
+            return " ".join(text for text, *_ in stale), False, stale[0][2], True, None
+        return self._backlog.popleft()
+
+    async def _run(self):
+        while True:
+            # The slot first: the backlog is judged stale when its translation can start, not before
+            await self._slots.acquire()
+            text, translated, received, summarize, session = await self._next()
+            self.waits.translation.observe(time.perf_counter() - received)
+            try:
+                if translated:
+                    # Already translated by the server for the language room of this client
+                    spoken, played = text, queue_text(self._speech, text, received)
+                elif session is not None:
+                    spoken = await session.commit(text)
+                    played = queue_text(self._speech, spoken, received)
+                elif self.stream_translation:
+                    spoken, played = await queue_translation(
+                        self._agent, self._speech, text, started=received, summarize=summarize)
+                else:
+                    spoken = await asyncio.to_thread(self._agent.translate, text, None, summarize)
+                    played = queue_text(self._speech, spoken, received)
+            except Exception as e:
+                self._slots.release()
+                print(f"Error while translating a message: {e}")
+                continue
+            played.add_done_callback(lambda future, text=text, spoken=spoken: self._played(future, text, spoken))
+
+    def _played(self, future, text, spoken):
+        self._slots.release()
+        if future.exception() is not None:
+            print(f"Error while speaking a message: {future.exception()}")
+            return
+        first_audio, duration = future.result()
+        print("Message translated:", spoken, " depuis ", text)
+        print(f"Time to first audio: {first_audio:.2f} s for {duration:.1f} s of speech")
+
+
+def pipeline_options_from_env():
+    """
+    SpeechPipeline options from env variables: TRANSLATE_PIPELINE (1 streams the translation into the synthesis,
+    default 1), SPEECH_AHEAD (messages translated and synthesized while one plays, default 1), SPEECH_BACKLOG
+    (default 8), SPEECH_STALE_AFTER (seconds, default 0: no age limit) and SPEECH_STALE_POLICY (keep, drop or
+    summarize, default keep).
+    """
+    return {
+        "stream_translation": os.getenv("TRANSLATE_PIPELINE", "1") == "1",
+        "ahead": int(os.getenv("SPEECH_AHEAD", 1)),
+        "max_backlog": int(os.getenv("SPEECH_BACKLOG", 8)),
+        "stale_after": float(os.getenv("SPEECH_STALE_AFTER", 0)),
+        "stale_policy": os.getenv("SPEECH_STALE_POLICY", "keep"),
+    }
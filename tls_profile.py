@@ -0,0 +1,57 @@
+""" TLS profile of the secure servers: resumption, protocol versions, curves, ciphers and certificates """
+import os
+import ssl
+
+# Forward secret AEAD suites only for TLS 1.2, ECDSA suites first (TLS 1.3 suites are not configurable)
+DEFAULT_CIPHERS = "ECDHE-ECDSA-AES128-GCM-SHA256:ECDHE-ECDSA-CHACHA20-POLY1305:ECDHE-ECDSA-AES256-GCM-SHA384:" \
+                  "ECDHE-RSA-AES128-GCM-SHA256:ECDHE-RSA-CHACHA20-POLY1305:ECDHE-RSA-AES256-GCM-SHA384"
+
+
+def server_context(certfile, keyfile, ecdsa_certfile=None, ecdsa_keyfile=None, tls13_only=False,
+                   session_tickets=True, num_tickets=2, ecdh_curve=None,
+                   ciphers=DEFAULT_CIPHERS):
+    """
+    Build the server SSLContext.
+    Reconnecting clients resume their session instead of a full handshake: with a session ticket in TLS 1.3
+    (num_tickets per handshake) and with a ticket or the OpenSSL server session cache in TLS 1.2.
+    The ticket keys are generated with the context, create it once before forking workers so all of them
+    accept the tickets of the others. An ECDSA certificate can be served next to the RSA one,
+    clients supporting it get the cheaper ECDSA signature.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_3 if tls13_only else ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile=certfile, keyfile=keyfile)
+    if ecdsa_certfile:
+        context.load_cert_chain(certfile=ecdsa_certfile, keyfile=ecdsa_keyfile)
+
+    context.options |= ssl.OP_NO_COMPRESSION | ssl.OP_CIPHER_SERVER_PREFERENCE | ssl.OP_NO_RENEGOTIATION
+    if session_tickets:
+        context.options &= ~ssl.OP_NO_TICKET
+        context.num_tickets = num_tickets
+    else:
+        context.options |= ssl.OP_NO_TICKET
+        context.num_tickets = 0
+    if ecdh_curve:
+        context.set_ecdh_curve(ecdh_curve)
+    if ciphers and not tls13_only:
+        context.set_ciphers(ciphers)
+    return context
+
+
+def server_context_from_env():
+    """
+    TLS profile from env variables:
+    TLS_CERT_FILE / TLS_KEY_FILE (default ./cert/localhost.crt and .key), TLS_ECDSA_CERT_FILE / TLS_ECDSA_KEY_FILE,
+    TLS_13_ONLY=1, TLS_SESSION_TICKETS=0, TLS_NUM_TICKETS, TLS_ECDH_CURVE (e.g. prime256v1) and TLS_CIPHERS
+    """
+    return server_context(
+        certfile=os.getenv("TLS_CERT_FILE", "./cert/localhost.crt"),
+        keyfile=os.getenv("TLS_KEY_FILE", "./cert/localhost.key"),
+        ecdsa_certfile=os.getenv("TLS_ECDSA_CERT_FILE"),
+        ecdsa_keyfile=os.getenv("TLS_ECDSA_KEY_FILE"),
+        tls13_only=os.getenv("TLS_13_ONLY", "0") == "1",
+        session_tickets=os.getenv("TLS_SESSION_TICKETS", "1") != "0",
+        num_tickets=int(os.getenv("TLS_NUM_TICKETS", 2)),
+        ecdh_curve=os.getenv("TLS_ECDH_CURVE"),
+        ciphers=os.getenv("TLS_CIPHERS", DEFAULT_CIPHERS),
+    )
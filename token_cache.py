@@ -0,0 +1,74 @@
+""" Bounded LRU cache of verified JWT tokens, for reconnect storms where the same tokens come back at once """
+import collections
+import hashlib
+import time
+
+
+class TokenCache:
+    """
+    Caches the result of verify(token) by SHA-256 digest of the token, so the token itself is never kept.
+    A valid payload is served until its "exp" claim (and at most max_ttl seconds),
+    an invalid token is remembered for negative_ttl seconds and rejected without decoding it again.
+    max_size=0 disables the cache, every call goes to verify.
+    """
+    def __init__(self, verify, max_size=10000, max_ttl=300, negative_ttl=60):
+        self._verify = verify
+        self._entries = collections.OrderedDict()  # digest -> (payload or None, expires_at)
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, token):
+        """ Return the payload of a valid token, None otherwise (a token that is not a str or bytes included) """
+        if not isinstance(token, (str, bytes)):
+            return None
+        if self.max_size <= 0:
+            self.misses += 1
+            return self._verify(token)
+
+        digest = hashlib.sha256(token.encode() if isinstance(token, str) else token).digest()
+        now = time.time()
+        entry = self._entries.get(digest)
+        if entry is not None:
+            payload, expires_at = entry
+            if now < expires_at:
+                self._entries.move_to_end(digest)
+                if payload is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return payload
+            del self._entries[digest]
+
+        self.misses += 1
+        payload = self._verify(token)
+        if payload is None:
+            expires_at = now + self.negative_ttl
+        else:
+            expires_at = now + self.max_ttl
+            exp = payload.get("exp") if isinstance(payload, dict) else None
+            if isinstance(exp, (int, float)):
+                expires_at = min(expires_at, exp)
+        self._entries[digest] = (payload, expires_at)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return payload
+
+    def stats(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 3) if lookups else 0,
+        }
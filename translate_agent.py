@@ -1,6 +1,12 @@
 from locale import normalize
+import asyncio
+import collections
 import ollama
 import unicodedata
+from segmenter import split_segments
+
+# Languages the clients listen and speak in, the only rooms of the servers
+LANGUAGES = ("English", "French", "Spanish", "German", "Italian", "Portuguese")
 
 
 def print_decorator(n):
@@ -9,11 +15,17 @@ def print_decorator(n):
 
 
 class TranslateAgent:
-    def __init__(self):
+    def __init__(self, model="", language="", cache_size=1024):
         self._detected_language = ""
-        self._language = ""
-        self._model = ""
+        self._language = language
+        self._model = model
         self._gender_speak = ""
+        self._async_client = None  # ollama.AsyncClient of translate_stream, created on first use
+        # Prefix cache of the translation sessions: (language, source segment) -> translation, least recently used first
+        self._cache = collections.OrderedDict()
+        self._cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
 
 
     def __list_model(self):
@@ -45,15 +57,53 @@ class TranslateAgent:
             self._model = models[0]
 
 
-    def translate(self, prompt):
-        """Translate the given prompt using the chosen model."""
+    def translate(self, prompt, language=None, summarize=False):
+        """Translate the given prompt using the chosen model, to the selected language unless another one is given.
+        With summarize, a short summary of the prompt is translated instead."""
        # self.detected_language = self.__detect_language(prompt)
-        messageToTranslate = f"Translate following text to {self._language} : {prompt}.Output needs to be the translation only."
+        messageToTranslate = self.__translation_prompt(prompt, language, summarize)
         print(messageToTranslate)
         res = ollama.generate(prompt=messageToTranslate, model=self._model, stream=False)
         #print("Response : ", res)
         return self.normalize_text(res['response'])
 
+    async def translate_stream(self, prompt, language=None, summarize=False):
+        """Translate like translate(), yielding the text deltas as the model generates them."""
+        if self._async_client is None:
+            self._async_client = ollama.AsyncClient()
+        stream = await self._async_client.generate(
+            prompt=self.__translation_prompt(prompt, language, summarize), model=self._model, stream=True)
+        async for part in stream:
+            if part['response']:
+                yield self.normalize_text(part['response'])
+
+    async def translate_segment(self, segment, language=None):
+        """Translate one segment of a transcript, from the prefix cache when it was already translated."""
+        key = (language or self._language, segment)
+        if key in self._cache:
+            self.cache_hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self.cache_misses += 1
+        translation = (await asyncio.to_thread(self.translate, segment, language)).strip()
+        self._cache[key] = translation
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return translation
+
+    def is_cached(self, segment, language=None):
+        """Whether the translation of the segment is in the prefix cache, without counting a hit or a miss."""
+        return (language or self._language, segment) in self._cache
+
+    def session(self, language=None):
+        """Start the incremental translation of an utterance still being spoken."""
+        return TranslationSession(self, language)
+
+    def __translation_prompt(self, prompt, language, summarize=False):
+        if summarize:
+            return f"Summarize briefly in {language or self._language} the following text : {prompt}.Output needs to be the summary only."
+        return f"Translate following text to {language or self._language} : {prompt}.Output needs to be the translation only."
+
     def normalize_text(self, text):
         # Normalize the text by decomposing accented characters
         # Filter out the accent marks
@@ -72,7 +122,7 @@ class TranslateAgent:
 
     def select_language(self):
         """ Select the language all received texts should be translated to """
-        languages = ["English", "French", "Spanish", "German", "Italian", "Portuguese"]
+        languages = LANGUAGES
         print_decorator(50)
         print("Select a language for this client to listen and speak")
         for idx, model in enumerate(languages):
@@ -100,6 +150,48 @@ class TranslateAgent:
             print("Invalid selection. First model in list will be used by default.")
             self._gender_speak = models[0]
 
+class TranslationSession:
+    """
+    Speculative translation of an utterance growing while it is spoken.
+    update(source) with the transcript so far translates its stable prefix, the complete sentences or long
+    phrases, in the background one segment at a time; the unfinished end is left for later. Every segment goes
+    through the prefix cache of the agent: a revised transcript only translates the segments that changed.
+    commit(source) translates what is left once the utterance is over and returns the whole translation,
+    usually one short segment instead of the whole utterance.
+    """
+    def __init__(self, agent, language=None):
+        self._agent = agent
+        self._language = language
+        self._source = ""
+        self._task = None
+
+    def update(self, source):
+        self._source = source
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._translate_stable())
+
+    async def commit(self, source):
+        self._source = source
+        if self._task is not None:
+            await self._task
+        segments, rest = split_segments(source)
+        if rest:
+            segments.append(rest)
+        return " ".join([await self._agent.translate_segment(segment, self._language) for segment in segments])
+
+    async def _translate_stable(self):
+        """ Translate the stable segments of the latest source until they are all in the cache """
+        while True:
+            segments, rest = split_segments(self._source)
+            missing = [segment for segment in segments if not self._agent.is_cached(segment, self._language)]
+            if not missing:
+                return
+            try:
+                await self._agent.translate_segment(missing[0], self._language)
+            except Exception:
+                return  # Speculation only, commit() translates the segment again
+
+
 if __name__ == "__main__":
     agent = TranslateAgent()
     print(agent.translate("Bonjour, comment ça va?"))
@@ -0,0 +1,185 @@
+""" Compact binary framing of speech, status and auth messages, negotiated next to the JSON messages """
+import itertools
+import json
+import os
+import struct
+
+# Subprotocol offered by the clients using binary frames, the others keep sending and receiving JSON
+SUBPROTOCOL = "relay.bin.v1"
+VERSION = 1
+
+SPEECH = 1
+STATUS = 2
+AUTH = 3
+TYPE_NAMES = {SPEECH: "speech", STATUS: "status", AUTH: "auth"}
+TYPES = {name: code for code, name in TYPE_NAMES.items()}
+# JSON field carrying the text of each type
+TEXT_FIELDS = {SPEECH: "text", STATUS: "status", AUTH: "token"}
+
+# Flags
+TRANSLATED = 0x01
+
+# Version, type, flags, sequence number, length of the UTF-8 text that follows
+HEADER = struct.Struct(">BBBII")
+
+_client_seq = itertools.count(1)
+
+
+def encode(msg_type, text, seq=0, flags=0):
+    """ Build a binary frame, msg_type is SPEECH, STATUS or AUTH """
+    payload = text.encode()
+    return HEADER.pack(VERSION, msg_type, flags, seq, len(payload)) + payload
+
+
+def parse_header(frame):
+    """ Return (type, flags, seq) of a binary frame, None if it is not a valid frame of this protocol """
+    if len(frame) < HEADER.size:
+        return None
+    version, msg_type, flags, seq, length = HEADER.unpack_from(frame)
+    if version != VERSION or msg_type not in TYPE_NAMES or HEADER.size + length != len(frame):
+        return None
+    return msg_type, flags, seq
+
+
+def decode(frame):
+    """ Decode a binary frame to the dict of the equivalent JSON message, None if invalid """
+    header = parse_header(frame)
+    if header is None:
+        return None
+    msg_type, flags, seq = header
+    text = _body(frame)
+    if text is None:
+        return None
+    data = {"type": TYPE_NAMES[msg_type], TEXT_FIELDS[msg_type]: text, "seq": seq}
+    if flags & TRANSLATED:
+        data["translated"] = True
+    return data
+
+
+def _body(frame):
+    """ Text of a binary frame, None if it is not valid UTF-8 """
+    try:
+        return bytes(frame[HEADER.size:]).decode()
+    except UnicodeDecodeError:
+        return None
+
+
+def frame(websocket, msg_type, text, **fields):
+    """
+    Client side: build the frame of a message for this connection, binary if negotiated,
+    JSON with the extra fields otherwise (the binary frame carries no extra field)
+    """
+    if uses_binary(websocket):
+        return encode(msg_type, text, next(_client_seq) & 0xFFFFFFFF)
+    return json.dumps({"type": TYPE_NAMES[msg_type], TEXT_FIELDS[msg_type]: text, **fields})
+
+
+def parse(message):
+    """ Client side: dict of a received JSON or binary message, None if it is neither """
+    if isinstance(message, str):
+        try:
+            return json.loads(message)
+        except json.JSONDecodeError:
+            return None
+    return decode(message)
+
+
+def client_subprotocols():
+    """ Subprotocols offered by the clients, binary frames are opted in with WS_BINARY=1 """
+    return [SUBPROTOCOL] if os.getenv("WS_BINARY", "0") == "1" else None
+
+
+def select_subprotocol(connection, subprotocols):
+    """ Server side negotiation: binary frames for the clients offering SUBPROTOCOL, JSON for the others """
+    return SUBPROTOCOL if SUBPROTOCOL in subprotocols else None
+
+
+def uses_binary(websocket):
+    return websocket.subprotocol == SUBPROTOCOL
+
+
+class Message:
+    """
+    A speech, status or auth message routed by the server.
+    It is sent as JSON to JSON clients and as a binary frame to binary clients, each encoding built at most once.
+    A message received as a binary frame keeps its body, relayed as is to the binary clients. The body is decoded
+    once on receipt, a frame that is not valid UTF-8 is dropped before being routed or kept in a history.
+    utterance is the id of the live transcript a speech commits (see live_transcript.py), JSON only.
+    """
+    __slots__ = ("type", "flags", "seq", "language", "utterance", "_text", "_json", "_binary")
+
+    def __init__(self, msg_type, text=None, seq=0, flags=0, language=None, utterance=None):
+        self.type = msg_type
+        self.flags = flags
+        self.seq = seq
+        self.language = language
+        self.utterance = utterance
+        self._text = text
+        self._json = None
+        self._binary = None
+
+    @classmethod
+    def from_binary(cls, frame):
+        """ Wrap a received binary frame, None if its header is invalid or its body is not UTF-8 """
+        header = parse_header(frame)
+        if header is None:
+            return None
+        text = _body(frame)
+        if text is None:
+            return None
+        message = cls(header[0], text, seq=header[2], flags=header[1])
+        message._binary = frame
+        return message
+
+    @classmethod
+    def from_json(cls, raw, data):
+        """ Wrap a parsed JSON message of a known type, the raw JSON is relayed as is to JSON clients """
+        msg_type = TYPES.get(data.get("type"))
+        text = data.get(TEXT_FIELDS.get(msg_type))
+        if msg_type is None or not isinstance(text, str):
+            return None
+        message = cls(msg_type, text, seq=data.get("seq", 0) if isinstance(data.get("seq"), int) else 0,
+                      flags=TRANSLATED if data.get("translated") else 0, language=data.get("language"),
+                      utterance=data.get("utterance") if isinstance(data.get("utterance"), str) else None)
+        message._json = raw
+        return message
+
+    def sequenced(self, seq):
+        """
+        Copy numbered seq in its room. A received binary frame keeps its body, only the header is rebuilt,
+        the JSON of the copy is built on first use.
+        """
+        message = Message(self.type, self._text, seq, self.flags, self.language, self.utterance)
+        if self._binary is not None:
+            message._binary = HEADER.pack(VERSION, self.type, self.flags, seq & 0xFFFFFFFF,
+                                          len(self._binary) - HEADER.size) + self._binary[HEADER.size:]
+        return message
+
+    def size(self):
+        """ Length of the text, without decoding a binary frame """
+        if self._binary is not None:
+            return len(self._binary) - HEADER.size
+        return len(self._text)
+
+    @property
+    def text(self):
+        return self._text
+
+    def as_json(self):
+        if self._json is None:
+            data = {"type": TYPE_NAMES[self.type], TEXT_FIELDS[self.type]: self.text}
+            if self.seq:
+                data["seq"] = self.seq
+            if self.language:
+                data["language"] = self.language
+            if self.flags & TRANSLATED:
+                data["translated"] = True
+            if self.utterance:
+                data["utterance"] = self.utterance
+            self._json = json.dumps(data)
+        return self._json
+
+    def as_binary(self):
+        if self._binary is None:
+            self._binary = encode(self.type, self.text, self.seq & 0xFFFFFFFF, self.flags)
+        return self._binary
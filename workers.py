@@ -0,0 +1,102 @@
+""" Multi-process mode for the relay servers: N workers share the port with SO_REUSEPORT and a local backplane """
+import asyncio
+import logging
+import os
+import signal
+import socket
+import tempfile
+import backplane
+
+# Set by the parent process for its workers
+WORKER_ENV = "WS_WORKER"
+
+
+def is_worker():
+    return WORKER_ENV in os.environ
+
+
+def reuse_port():
+    """ Workers bind the same port, the kernel spreads the incoming connections between them """
+    return is_worker()
+
+
+def run(main, count):
+    """
+    Run main() in the current process, or fork count workers running it when count > 1.
+    Unless WS_BACKPLANE already links several nodes, the parent serves a broker on a Unix socket
+    as the backplane of its workers. It forwards SIGINT/SIGTERM to the workers, which drain their connections
+    (see drain.py) before exiting, and keeps the broker up until the last one exited.
+    """
+    if count <= 1:
+        asyncio.run(main())
+        return
+
+    sock = None
+    if not os.getenv("WS_BACKPLANE"):
+        path = os.path.join(tempfile.mkdtemp(prefix="ws-bus-"), "bus.sock")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.listen(count)
+        os.environ["WS_BACKPLANE"] = f"unix://{path}"
+    os.environ[WORKER_ENV] = "1"
+
+    pids = []
+    for _ in range(count):
+        pid = os.fork()
+        if pid == 0:
+            if sock is not None:
+                sock.close()
+            try:
+                asyncio.run(main())
+            except KeyboardInterrupt:
+                pass
+            finally:
+                # os._exit skips the atexit handlers, flush the logs of the worker first
+                logging.shutdown()
+                os._exit(0)
+        pids.append(pid)
+    print(f"Started {count} workers: {pids}")
+
+    try:
+        asyncio.run(_supervise(pids, sock))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        if sock is not None:
+            os.unlink(path)
+            os.rmdir(os.path.dirname(path))
+
+
+async def _supervise(pids, sock):
+    """ Serve the broker of the workers (if any) until they all exited, forwarding them the stop signals """
+    loop = asyncio.get_running_loop()
+
+    def forward(signum):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, forward, signum)
+    broker = asyncio.create_task(backplane.serve_broker(sock=sock)) if sock is not None else None
+    await asyncio.gather(*(asyncio.to_thread(_wait, pid) for pid in pids))
+    if broker is not None:
+        broker.cancel()
+        try:
+            await broker
+        except asyncio.CancelledError:
+            pass
+
+
+def _wait(pid):
+    try:
+        os.waitpid(pid, 0)
+    except ChildProcessError:
+        pass
@@ -1,14 +1,15 @@
 #!/usr/bin/env python3
 ## Websocket client SSL + JWT to secure connection
 import asyncio
-import websockets
-import json
 import threading
 import ssl
 import jwt
 import os
 from dotenv import load_dotenv
 import uuid
+import wire_protocol
+from wire_protocol import SPEECH, STATUS
+from relay_client import RelayClient
 
 # Create UUID for this client
 user_id = str(uuid.uuid4())
@@ -18,6 +19,7 @@ load_dotenv()
 
 secret = os.getenv("SECRET_KEY")
 url = os.getenv("WS_URL") # for production
+presence = os.getenv("WS_PRESENCE", "0") == "1"  # Announce this client with a status message
 
 ssl_context = ssl.create_default_context()
 ssl_context.check_hostname = False
@@ -30,14 +32,13 @@ def generate_token(user_id):
     return jwt.encode(payload, secret, algorithm="HS256")
 
 
-async def handle_messages(websocket):
+async def handle_messages(websocket, client):
     """
     Continuously listens to messages received from the server and displays them immediately.
     """
     async for message in websocket:
-        try:
-            data = json.loads(message)
-        except json.JSONDecodeError:
+        data = client.parse(message)
+        if data is None:
             print("Received message is not a valid JSON.")
             continue
 
@@ -49,9 +50,10 @@ async def handle_messages(websocket):
 
 async def send_status(websocket, status):
     """
-    Sends a "status" type message to indicate the client's status.
+    Sends a "status" type message to announce the client's presence, only with WS_PRESENCE=1.
+    Utterances do not need it, the server never relays a message back to its sender.
     """
-    message = json.dumps({"type": "status", "status": status})
+    message = wire_protocol.frame(websocket, STATUS, status)
     await websocket.send(message)
 
 
@@ -59,33 +61,16 @@ async def send_text(websocket, text):
     """
     Sends a "speech" type message containing the entered text.
     """
-    message = json.dumps({
-        "type": "speech",
-        "text": text,
-        "from": str(websocket.remote_address)
-    })
+    message = wire_protocol.frame(websocket, SPEECH, text, **{"from": str(websocket.remote_address)})
     print("Message sent")
     print(message)
     await websocket.send(message)
 
 
-async def send_inactive_delay(websocket):
-    """
-    Waits for a short delay and then sets the client's status to "inactive".
-    """
-    await asyncio.sleep(0.1)
-    await send_status(websocket, "inactive")
-
-async def send_authentication(websocket, token):
-    """Sends the authentication message with the JWT token."""
-    auth_message = json.dumps({"type": "auth", "token": token})
-    await websocket.send(auth_message)
-
-
-def input_thread(websocket, loop):
+def input_thread(client):
     """
     Function executed in a separate thread for user input.
-    For each entered message, the corresponding coroutines are scheduled in the loop.
+    For each entered message, the corresponding coroutines are queued in the client, sent once connected.
     """
     while True:
         try:
@@ -96,35 +81,32 @@ def input_thread(websocket, loop):
         if text == "":
             continue  # Ignore empty inputs
 
-        # Schedule the sending of messages in the asynchronous loop via run_coroutine_threadsafe
-        asyncio.run_coroutine_threadsafe(send_status(websocket, "active"), loop)
-        asyncio.run_coroutine_threadsafe(send_text(websocket, text), loop)
-        asyncio.run_coroutine_threadsafe(send_inactive_delay(websocket), loop)
+        # Schedule the sending of messages in the asynchronous loop, one speech message per utterance
+        client.submit_threadsafe(send_text, text)
 
 
 async def start_client():
     """
-    Connects to the server and starts tasks for displaying received messages
+    Connects to the server, reconnecting after an outage, and starts tasks for displaying received messages
     and user input via a thread.
     """
-    websocket_url = "wss://" + WS_URL  # Production: Check URL is correct, Dev mode: switch IP and PORT
-    async with websockets.connect(websocket_url, ssl=ssl_context) as websocket:
-        print("WebSocket connection established.")
-
-        # Generate and send the JWT token (example with user_id=1)
-        token = generate_token(user_id)
-        await send_authentication(websocket, token)
-
-        # Get the current asynchronous loop
-        loop = asyncio.get_running_loop()
-        # Start the thread for user input
-        thread = threading.Thread(target=input_thread, args=(websocket, loop), daemon=True)
-        thread.start()
+    websocket_url = "wss://" + url  # Production: Check URL is correct, Dev mode: switch IP and PORT
 
-        try:
-            await handle_messages(websocket)
-        except websockets.ConnectionClosed as e:
-            print(f"Connection closed: {e}")
+    async def on_connect(websocket):
+        print("WebSocket connection established.")
+        if presence:
+            await send_status(websocket, "online")
+
+    # A new JWT token is generated for every connection, sent with the upgrade request and checked by the server
+    # before accepting the connection
+    client = RelayClient(
+        websocket_url, on_connect=on_connect, headers=lambda: {"Authorization": f"Bearer {generate_token(user_id)}"},
+        ssl=ssl_context, subprotocols=wire_protocol.client_subprotocols(),
+    )
+    # Start the thread for user input
+    thread = threading.Thread(target=input_thread, args=(client,), daemon=True)
+    thread.start()
+    await client.run(lambda websocket: handle_messages(websocket, client))
 
 
 if __name__ == "__main__":
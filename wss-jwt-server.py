@@ -2,104 +2,124 @@
 
 import asyncio
 import websockets
-import logging
 import os
-import ssl
-import json
 import jwt
-from dotenv import load_dotenv
-
-# Configure logging to write in "server.log" in append mode
-logging.basicConfig(
-    level=logging.INFO,
-    filename="server.log",
-    filemode="a",
-    format="%(asctime)s %(message)s"
-)
-
-# Create SSL context, .crt and .key files are needed
-# Self signed certificates generated in development mode, use signing authority in production like Letsecrypt
-ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-ssl_context.load_cert_chain(certfile='./cert/localhost.crt', keyfile='./cert/localhost.key')
-
-# Get env variables for dev mode
-load_dotenv()
-port = os.getenv("WS_PORT")
-ip = os.getenv("WS_IP")
+import http
+from urllib.parse import urlparse, parse_qs
+import relay_server
+from relay_server import log, metrics
+import tls_profile
+from token_cache import TokenCache
+import wire_protocol
+from session import Session
+
 secret = os.getenv("SECRET_KEY")
-# Global dictionary of clients: websocket -> status ("active" or "inactive")
-clients = {}
 
-def verify_token(token):
-    """Verifies the validity of the JWT token and returns the payload if valid."""
+# Create SSL context, .crt and .key files are needed (TLS_CERT_FILE and TLS_KEY_FILE, ./cert/localhost.* by default)
+# Self-signed certificates generated in development mode, use a signing authority in production like Let's Encrypt
+# Session resumption, TLS 1.3 only mode, ECDSA certificate and curves are set by the TLS_* env variables, see tls_profile.py
+ssl_context = tls_profile.server_context_from_env()
+
+def decode_token(token):
+    """Decodes and verifies the JWT token, returns the payload if valid."""
     try:
         payload = jwt.decode(token, secret, algorithms=["HS256"])
         return payload
     except jwt.InvalidTokenError:
         return None
 
-async def handler(websocket):
-    logging.info(f"Client connected: {websocket.remote_address}")
-    print(f"Client connected: {websocket.remote_address}")
+# Verified (and rejected) tokens are cached by digest until they expire, JWT_CACHE_SIZE=0 disables the cache
+token_cache = TokenCache(decode_token, max_size=int(os.getenv("JWT_CACHE_SIZE", 10000)))
 
-    # Wait for the authentication message
+def verify_token(token):
+    """Verifies the validity of the JWT token and returns the payload if valid."""
+    return token_cache.get(token)
+
+# Clients that send no token with the HTTP request authenticate with a first "auth" message within AUTH_TIMEOUT seconds,
+# WS_AUTH_LEGACY=0 rejects them before the upgrade instead
+auth_timeout = float(os.getenv("AUTH_TIMEOUT", 5))
+auth_legacy = os.getenv("WS_AUTH_LEGACY", "1") != "0"
+# Subprotocol announcing a token sent as the next subprotocol: Sec-WebSocket-Protocol: bearer, <token>
+bearer_subprotocol = "bearer"
+
+def request_token(request):
+    """Returns the token sent with the upgrade request: Authorization header, subprotocol or ?token= query string."""
+    authorization = request.headers.get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        return authorization[len("Bearer "):].strip()
+    protocols = [p.strip() for p in ",".join(request.headers.get_all("Sec-WebSocket-Protocol")).split(",")]
+    if bearer_subprotocol in protocols and protocols.index(bearer_subprotocol) + 1 < len(protocols):
+        return protocols[protocols.index(bearer_subprotocol) + 1]
+    tokens = parse_qs(urlparse(request.path).query).get("token")
+    return tokens[0] if tokens else None
+
+def process_request(connection, request):
+    """Authenticates the client before the upgrade, an invalid token gets an HTTP 401 instead of a websocket."""
+    response = metrics.process_request(connection, request)
+    if response is not None:
+        return response
+    token = request_token(request)
+    if token is None:
+        if auth_legacy:
+            connection.auth_payload = None
+            return None
+        metrics.auth_failures += 1
+        return connection.respond(http.HTTPStatus.UNAUTHORIZED, "Missing token\n")
+    payload = verify_token(token)
+    if not payload:
+        log.info("Rejected invalid token from %s", connection.remote_address)
+        metrics.auth_failures += 1
+        return connection.respond(http.HTTPStatus.UNAUTHORIZED, "Invalid token\n")
+    connection.auth_payload = payload
+    return None
+
+def select_subprotocol(connection, subprotocols):
+    """Answers the binary wire protocol if offered, then the bearer subprotocol to clients sending their token with it."""
+    return wire_protocol.select_subprotocol(connection, subprotocols) or (
+        bearer_subprotocol if bearer_subprotocol in subprotocols else None)
+
+async def authenticate(websocket):
+    """Legacy flow: waits for the authentication message, returns the payload or None once the connection is closed."""
     try:
-        auth_message = await websocket.recv()
-        data = json.loads(auth_message)
-        if data.get("type") != "auth" or "token" not in data:
+        auth_message = await asyncio.wait_for(websocket.recv(), auth_timeout)
+        data = wire_protocol.parse(auth_message)
+        if not isinstance(data, dict) or data.get("type") != "auth" or "token" not in data:
             # Close the connection if the authentication message is invalid
             await websocket.close(1008, "Invalid authentication message")
-            return
+            return None
         token = data["token"]
         payload = verify_token(token)
         if not payload:
             # Close the connection if the token is invalid
             await websocket.close(1008, "Invalid token")
-            return
-        # Log and print the authenticated client
-        logging.info(f"Authenticated client: {payload}")
-        print(f"Authenticated client: {payload}")
-    except (json.JSONDecodeError, websockets.ConnectionClosed):
+            return None
+        return payload
+    except asyncio.TimeoutError:
+        await websocket.close(1008, "Authentication timeout")
+        return None
+    except websockets.ConnectionClosed:
         await websocket.close(1008, "Authentication error")
-        return
-
+        return None
 
-    # Add the client with a default "inactive" status
-    clients[websocket] = "inactive"
-    try:
-        async for message in websocket:
-            # Log the received message in the log file
-            logging.info(f"Message received from {websocket.remote_address}: {message}")
-
-            # Mark the sender as "active"
-            clients[websocket] = "active"
-
-            # Broadcast the message to all clients with the "inactive" status
-            broadcast_clients = [
-                ws for ws, status in clients.items() if status == "inactive"
-            ]
-            if broadcast_clients:
-                await asyncio.gather(*[ws.send(message) for ws in broadcast_clients])
-
-            # Set the sender's status back to "inactive"
-            clients[websocket] = "inactive"
-    except websockets.ConnectionClosed:
-        logging.info(f"Connection closed: {websocket.remote_address}")
-        print(f"Connection closed: {websocket.remote_address}")
-    finally:
-        # Cleanup when the client disconnects
-        del clients[websocket]
-        logging.info(f"Client disconnected: {websocket.remote_address}")
-        print(f"Client disconnected: {websocket.remote_address}")
+async def handler(websocket):
+    log.info("Client connected: %s", websocket.remote_address)
+
+    # Authenticated in process_request, or wait for the authentication message
+    payload = websocket.auth_payload
+    if payload is None:
+        payload = await authenticate(websocket)
+        if payload is None:
+            metrics.auth_failures += 1
+            return
+    # Log the authenticated client
+    log.info("Authenticated client: %s", payload)
+    await relay_server.relay(Session(websocket, payload.get("user_id")))
 
 
 async def main():
-
-
-    async with websockets.serve(handler, ip, port, ssl=ssl_context):
-        print(f"Server started at wss://{ip}:{port}")
-        await asyncio.Future()  # Keeps the server running indefinitely
+    await relay_server.serve(handler, ssl=ssl_context, process_request=process_request,
+                             select_subprotocol=select_subprotocol)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    relay_server.run(main)